@@ -1,9 +1,21 @@
 # poetry run python project01/console.py
 # poetry run python project01/console.py -f project01/books/The_Way_of_Kings-Sanderson-Brandon.txt project01/books/Droga_Krolow-Brandon_Sanderson.txt -m 7 -ml 3
 # poetry run python project01/console.py -c project01/books/ -m 7 -ml 3 -chs th -mhs al
+# poetry run python project01/console.py -c project01/books/ -w 4 -ss 1 --combined
 
 import argparse
+import codecs
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import glob
+import hashlib
+import heapq
+import itertools
+import os
+import pickle
+import re
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import rich
 import rich.traceback
 from ascii_graph import Pyasciigraph
@@ -24,12 +36,56 @@ from _collections_abc import Iterable
 
 collections.Iterable = Iterable
 
+# bytes read at once, memory is bounded by this and the vocabulary
+CHUNK_SIZE = 1 << 20
+# ASCII whitespace bytes never occur inside a multi-byte UTF-8 character
+WHITESPACE = re.compile(rb"[ \t\n\r\x0b\x0c]")
+# bits per word ID in an n-gram code, 3 IDs fit in an int64
+ID_BITS = 21
 
-def load_file(filename: str):
-    with open(filename, encoding="utf8") as book:
-        text = book.read().lower()
-        words = text.split()
-    return words
+
+def iter_words(filename: str, start=0, end=None, chunk_size=CHUNK_SIZE):
+    # yields (words, bytes read) per chunk of the byte range start..end, a word
+    # cut by the chunk boundary is carried over to the next chunk and so is a
+    # cut multi-byte character
+    decoder = codecs.getincrementaldecoder("utf8")()
+    carry = ""
+    with open(filename, "rb") as book:
+        book.seek(start)
+        remaining = (os.path.getsize(filename) if end is None else end) - start
+        while chunk := book.read(min(chunk_size, remaining)):
+            remaining -= len(chunk)
+            text = carry + decoder.decode(chunk).lower()
+            words = text.split()
+            carry = ""
+            if words and not text[-1].isspace():
+                carry = words.pop()
+            yield words, len(chunk)
+
+    text = carry + decoder.decode(b"", final=True).lower()
+    yield text.split(), 0
+
+
+def compile_sequences(must_have_sequence=None, cant_have_sequence=None):
+    # one regex for all sequences: a lookahead per required sequence and a
+    # negative lookahead over the alternation of the forbidden ones
+    must = set(must_have_sequence or ())
+    cant = set(cant_have_sequence or ())
+    # a sequence inside a longer required one is implied by it, a forbidden
+    # sequence containing a shorter forbidden one is already excluded by it
+    must = {a for a in must if not any(a != b and a in b for b in must)}
+    cant = {a for a in cant if not any(a != b and b in a for b in cant)}
+    if any(b in a for a in must for b in cant):
+        return None
+    pattern = ""
+    if cant:
+        # longest first, so the alternation tries the longest sequences first
+        sequences = sorted(cant, key=len, reverse=True)
+        pattern += f"(?!.*(?:{'|'.join(map(re.escape, sequences))}))"
+    for sequence in sorted(must, key=len, reverse=True):
+        pattern += f"(?=.*{re.escape(sequence)})"
+
+    return re.compile(pattern, re.DOTALL)
 
 
 def get_words_set(
@@ -39,30 +95,28 @@ def get_words_set(
     must_have_sequence=None,
     cant_have_sequence=None,
 ):
-    words_set = set(words)
-    for word in words_set.copy():
-        if len(word) < min_length:
-            words_set.discard(word)
+    # words are the distinct words, every filter runs once per word
+    ignore_words = set(ignore_words or ())
+    sequences = compile_sequences(must_have_sequence, cant_have_sequence)
+    if sequences is None:
+        return set()
+    if not sequences.pattern:
+        return {
+            word
+            for word in words
+            if len(word) >= min_length and word not in ignore_words
+        }
 
-        if ignore_words is not None:
-            if word in ignore_words:
-                words_set.discard(word)
+    match = sequences.match
+    return {
+        word
+        for word in words
+        if len(word) >= min_length and word not in ignore_words and match(word)
+    }
 
-        if must_have_sequence is not None:
-            for sequence in must_have_sequence:
-                if sequence not in word:
-                    words_set.discard(word)
 
-        if cant_have_sequence is not None:
-            for sequence in cant_have_sequence:
-                if sequence in word:
-                    words_set.discard(word)
-
-    return words_set
-
-
-def count_words(words, words_set, num_words):
-    progress_bar = Progress(
+def make_progress_bar():
+    return Progress(
         TextColumn("Words Counting:"),
         TextColumn("[bold green]{task.percentage:>3.0f}% "),
         BarColumn(
@@ -76,17 +130,240 @@ def count_words(words, words_set, num_words):
         TextColumn("[bold black]/"),
         TimeRemainingColumn(),
     )
-    words_dict = {word: 0 for word in words_set}
-    with progress_bar as p:
-        for word in p.track(words):
-            if word in words_dict.keys():
-                words_dict[word] += 1
 
-    most_common_words = sorted(
-        words_dict.items(), key=lambda item: item[1], reverse=True
+
+class TokenCounter:
+    # the token stream as int32 IDs of an interned vocabulary, words are counted
+    # with np.bincount and n-grams are packed into one int64 code per window
+    def __init__(self, ngram=1):
+        self.ngram = ngram
+        self.vocabulary = {}
+        self.word_counts = np.zeros(0, dtype=np.int64)
+        self.ngram_counts = Counter()
+        # first and last ngram - 1 words, for n-grams across shard boundaries
+        self.head = []
+        self.tail = np.zeros(0, dtype=np.int32)
+
+    def update(self, words):
+        vocabulary = self.vocabulary
+        new_words = set(words).difference(vocabulary)
+        vocabulary.update(zip(new_words, itertools.count(len(vocabulary))))
+        ids = np.fromiter(
+            map(vocabulary.__getitem__, words), dtype=np.int32, count=len(words)
+        )
+        if self.ngram == 1:
+            counts = np.bincount(ids, minlength=len(vocabulary))
+            counts[: len(self.word_counts)] += self.word_counts
+            self.word_counts = counts
+            return
+
+        if len(vocabulary) > 1 << ID_BITS:
+            raise ValueError("Vocabulary too large for n-gram codes")
+        self.head += words[: self.ngram - 1 - len(self.head)]
+        stream = np.concatenate([self.tail, ids])
+        if len(stream) >= self.ngram:
+            windows = sliding_window_view(stream, self.ngram).astype(np.int64)
+            shifts = ID_BITS * np.arange(self.ngram - 1, -1, -1)
+            codes, counts = np.unique(
+                (windows << shifts).sum(axis=1), return_counts=True
+            )
+            self.ngram_counts.update(dict(zip(codes.tolist(), counts.tolist())))
+        self.tail = stream[max(0, len(stream) - self.ngram + 1) :]
+
+    def counts(self):
+        words = list(self.vocabulary)
+        if self.ngram == 1:
+            return Counter(dict(zip(words, self.word_counts.tolist())))
+
+        # object arrays join the words of all n-grams in one vectorized pass
+        words = np.array(words, dtype=object)
+        codes = np.fromiter(self.ngram_counts, dtype=np.int64)
+        mask = (1 << ID_BITS) - 1
+        texts = words[codes >> ID_BITS * (self.ngram - 1)]
+        for k in range(self.ngram - 2, -1, -1):
+            texts = texts + " " + words[(codes >> ID_BITS * k) & mask]
+        return Counter(dict(zip(texts.tolist(), self.ngram_counts.values())))
+
+    def tail_words(self):
+        words = list(self.vocabulary)
+        return [words[i] for i in self.tail.tolist()]
+
+
+def count_tokens(filename, ngram=1):
+    counter = TokenCounter(ngram)
+    with make_progress_bar() as p:
+        task = p.add_task("", total=os.path.getsize(filename))
+        for words, size in iter_words(filename):
+            counter.update(words)
+            p.advance(task, size)
+
+    return counter.counts()
+
+
+def shard_file(filename, shard_size):
+    # (filename, start, end) byte ranges of about shard_size, every range but
+    # the last ends at an ASCII whitespace byte, so no word is cut
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, "rb") as book:
+        position = shard_size
+        while position < size:
+            book.seek(position)
+            while block := book.read(1 << 16):
+                match = WHITESPACE.search(block)
+                if match:
+                    position += match.start()
+                    break
+                position += len(block)
+            if position >= size:
+                break
+            bounds.append(position)
+            position += shard_size
+    bounds.append(size)
+
+    return [(filename, start, end) for start, end in zip(bounds, bounds[1:])]
+
+
+def count_shard(filename, start, end, ngram=1):
+    counter = TokenCounter(ngram)
+    for words, _ in iter_words(filename, start, end):
+        counter.update(words)
+
+    return counter.counts(), counter.head, counter.tail_words()
+
+
+def boundary_ngrams(tail, head, ngram):
+    # n-grams with words on both sides of a shard boundary
+    words = tail + head
+    first = max(0, len(tail) - ngram + 1)
+    last = min(len(tail), len(words) - ngram + 1)
+    return Counter(" ".join(words[i : i + ngram]) for i in range(first, last))
+
+
+def tokenize_files(files, workers=None, shard_size=16 << 20, ngram=1):
+    # yields (filename, counts) in input order as soon as all shards of a file
+    # are counted, shards are submitted in that order, so only the files in
+    # progress are held in memory
+    files = list(dict.fromkeys(files))
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        for file_name in files:
+            yield file_name, count_tokens(file_name, ngram)
+        return
+    if not files:
+        return
+
+    shards = [shard for name in files for shard in shard_file(name, shard_size)]
+    remaining = Counter(file_name for file_name, _, _ in shards)
+    partial = {}
+    edges = {}
+    owners = {}
+    finished = {}
+    next_file = 0
+    shards_left = iter(shards)
+    with ProcessPoolExecutor(workers) as executor, make_progress_bar() as p:
+        task = p.add_task("", total=sum(end - start for _, start, end in shards))
+        while True:
+            # a bounded number of shards in flight keeps the results small
+            for shard in itertools.islice(shards_left, 2 * workers - len(owners)):
+                owners[executor.submit(count_shard, *shard, ngram)] = shard
+            if not owners:
+                break
+            done, _ = wait(owners, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_name, start, end = owners.pop(future)
+                counts, head, tail = future.result()
+                partial.setdefault(file_name, Counter()).update(counts)
+                edges.setdefault(file_name, []).append((start, head, tail))
+                p.advance(task, end - start)
+                remaining[file_name] -= 1
+                if not remaining[file_name]:
+                    counts = partial.pop(file_name)
+                    shards = sorted(edges.pop(file_name), key=lambda edge: edge[0])
+                    for (_, _, tail), (_, head, _) in zip(shards, shards[1:]):
+                        counts.update(boundary_ngrams(tail, head, ngram))
+                    finished[file_name] = counts
+            while next_file < len(files) and files[next_file] in finished:
+                yield files[next_file], finished.pop(files[next_file])
+                next_file += 1
+
+
+class CountCache:
+    # raw word counts per file, keyed by path, size and modification time, the
+    # least recently used entries are evicted above max_bytes
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, filename, ngram=1):
+        stat = os.stat(filename)
+        key = f"{os.path.abspath(filename)}\0{stat.st_size}\0{stat.st_mtime_ns}"
+        key += f"\0{ngram}"
+        name = hashlib.sha256(key.encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"{name}.pickle")
+
+    def contains(self, filename, ngram=1):
+        return os.path.exists(self.path(filename, ngram))
+
+    def get(self, filename, ngram=1):
+        path = self.path(filename, ngram)
+        try:
+            with open(path, "rb") as f:
+                counts = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # the modification time of an entry is its last use
+        os.utime(path)
+        return counts
+
+    def put(self, filename, counts, ngram=1):
+        path = self.path(filename, ngram)
+        with open(f"{path}.{os.getpid()}", "wb") as f:
+            pickle.dump(counts, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.{os.getpid()}", path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+def count_files(files, workers=None, shard_size=16 << 20, cache=None, ngram=1):
+    # yields (filename, counts) in input order, cached files are read when
+    # their turn comes and the rest is tokenized meanwhile and stored
+    files = list(dict.fromkeys(files))
+    cached = {name for name in files if cache and cache.contains(name, ngram)}
+    tokenized = tokenize_files(
+        [name for name in files if name not in cached], workers, shard_size, ngram
     )
+    for file_name in files:
+        counts = cache.get(file_name, ngram) if file_name in cached else None
+        if counts is None:
+            if file_name in cached:
+                # an unreadable entry, counted again here
+                counts = count_tokens(file_name, ngram)
+            else:
+                _, counts = next(tokenized)
+            if cache:
+                cache.put(file_name, counts, ngram)
+        yield file_name, counts
+    tokenized.close()
+
+
+def count_words(counts, words_set, num_words):
+    most_common_words = heapq.nlargest(num_words, words_set, key=counts.__getitem__)
 
-    return most_common_words[:num_words]
+    return [(word, counts[word]) for word in most_common_words]
 
 
 def create_histogram(most_common_words, file):
@@ -141,32 +418,95 @@ def get_arguments():
         type=str,
         help="Sequence that words cant to have",
     )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        help="Number of counting processes, 1 counts in this process "
+        "(default all cores).",
+    )
+    parser.add_argument(
+        "--shard_size",
+        "-ss",
+        type=int,
+        default=16,
+        help="Size in MB of the parts large files are split into (default 16).",
+    )
+    parser.add_argument(
+        "--ngram",
+        "-ng",
+        type=int,
+        choices=[1, 2, 3],
+        default=1,
+        help="Count sequences of this many words, the filters apply to the whole "
+        "sequence (default 1).",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        "-cd",
+        type=str,
+        default=os.path.join(os.path.dirname(__file__), "__pycache__", "counts"),
+        help="Directory of the word count cache (default project01/__pycache__).",
+    )
+    parser.add_argument(
+        "--cache_size",
+        "-cs",
+        type=int,
+        default=256,
+        help="Size limit of the word count cache in MB (default 256).",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Count every file again and leave the cache untouched.",
+    )
+    parser.add_argument(
+        "--combined",
+        action="store_true",
+        help="Also show the histogram of all files together.",
+    )
     args = parser.parse_args()
 
     return args
 
-rich.traceback.install()
-rich.get_console().clear()
-rich.get_console().rule("Console program", style="bold cyan")
-
-args = get_arguments()
-
-if args.file:
-    files = args.file
-elif args.catalog:
-    files = glob.glob(args.catalog[0] + "*")
-
-for file_name in files:
-    words = load_file(file_name)
+def show_histogram(counts, title, args):
     words_set = get_words_set(
-        words,
+        counts,
         min_length=args.min_length,
         ignore_words=args.ignore_words,
         must_have_sequence=args.must_have_sequence,
         cant_have_sequence=args.cant_have_sequence,
     )
-    most_common = count_words(words, words_set, num_words=args.num_words)
-    create_histogram(most_common, file_name)
+    most_common = count_words(counts, words_set, num_words=args.num_words)
+    create_histogram(most_common, title)
     print()
 
-rich.get_console().rule("Completed!", style=" bold cyan")
+
+if __name__ == "__main__":
+    rich.traceback.install()
+    rich.get_console().clear()
+    rich.get_console().rule("Console program", style="bold cyan")
+
+    args = get_arguments()
+
+    if args.file:
+        files = args.file
+    elif args.catalog:
+        files = glob.glob(args.catalog[0] + "*")
+
+    cache = None
+    if not args.no_cache:
+        cache = CountCache(args.cache_dir, args.cache_size << 20)
+
+    combined = Counter()
+    counted = count_files(
+        files, args.workers, args.shard_size << 20, cache, args.ngram
+    )
+    for file_name, counts in counted:
+        show_histogram(counts, file_name, args)
+        if args.combined:
+            combined.update(counts)
+    if args.combined:
+        show_histogram(combined, "Combined corpus", args)
+
+    rich.get_console().rule("Completed!", style=" bold cyan")
@@ -0,0 +1,137 @@
+import numpy as np
+from numba import njit
+
+# Cluster kernels of ising.py, imported only by the cluster modes. They keep
+# totals = [M, E] of the lattice up to date as clusters flip.
+
+
+@njit(cache=True)
+def total_energy(grid, n, J, B):
+    energy = 0.0
+    for i in range(n):
+        for j in range(n):
+            neighbors = grid[(i + 1) % n, j] + grid[i, (j + 1) % n]
+            energy -= grid[i, j] * (J * neighbors + B)
+
+    return energy
+
+
+@njit(cache=True)
+def wolff_cluster(grid, n, J, B, p_add, beta, stack, cluster, in_cluster, totals):
+    i = np.random.randint(0, n)
+    j = np.random.randint(0, n)
+    spin = grid[i, j]
+    in_cluster[i, j] = True
+    cluster[0] = i * n + j
+    stack[0] = i * n + j
+    size = 1
+    top = 1
+    while top > 0:
+        top -= 1
+        i = stack[top] // n
+        j = stack[top] % n
+        for ni, nj in (
+            ((i + 1) % n, j),
+            ((i - 1) % n, j),
+            (i, (j + 1) % n),
+            (i, (j - 1) % n),
+        ):
+            if (
+                not in_cluster[ni, nj]
+                and grid[ni, nj] == spin
+                and np.random.random() < p_add
+            ):
+                in_cluster[ni, nj] = True
+                cluster[size] = ni * n + nj
+                stack[top] = ni * n + nj
+                size += 1
+                top += 1
+
+    dE = 2 * B * spin * size
+    flip = dE < 0 or np.random.random() < np.exp(-beta * dE)
+    if flip:
+        # only bonds across the cluster boundary change their energy
+        for k in range(size):
+            i = cluster[k] // n
+            j = cluster[k] % n
+            for ni, nj in (
+                ((i + 1) % n, j),
+                ((i - 1) % n, j),
+                (i, (j + 1) % n),
+                (i, (j - 1) % n),
+            ):
+                if not in_cluster[ni, nj]:
+                    dE += 2 * J * spin * grid[ni, nj]
+        totals[0] -= 2 * spin * size
+        totals[1] += dE
+    for k in range(size):
+        i = cluster[k] // n
+        j = cluster[k] % n
+        in_cluster[i, j] = False
+        if flip:
+            grid[i, j] *= -1
+
+    return size
+
+
+@njit(cache=True)
+def wolff_calibrate(grid, n, J, B, p_add, beta, stack, cluster, in_cluster, totals):
+    # number of clusters needed to visit n*n sites, used as the fixed
+    # number of clusters per sweep (a state-dependent stopping rule is biased)
+    visited = 0
+    clusters = 0
+    while visited < n * n:
+        visited += wolff_cluster(
+            grid, n, J, B, p_add, beta, stack, cluster, in_cluster, totals
+        )
+        clusters += 1
+
+    return clusters
+
+
+@njit(cache=True)
+def wolff_step(
+    grid, n, J, B, p_add, beta, clusters, stack, cluster, in_cluster, totals
+):
+    for _ in range(clusters):
+        wolff_cluster(grid, n, J, B, p_add, beta, stack, cluster, in_cluster, totals)
+
+
+@njit(cache=True)
+def find_root(parent, k):
+    while parent[k] != k:
+        parent[k] = parent[parent[k]]
+        k = parent[k]
+
+    return k
+
+
+@njit(cache=True)
+def swendsen_wang_step(grid, n, J, B, p_add, beta, parent, sizes, totals):
+    # bonds are joined with union-find, every root is the smallest flat index
+    # of its cluster
+    for k in range(n * n):
+        parent[k] = k
+        sizes[k] = 0
+    for i in range(n):
+        for j in range(n):
+            for ni, nj in (((i + 1) % n, j), (i, (j + 1) % n)):
+                if grid[i, j] == grid[ni, nj] and np.random.random() < p_add:
+                    a = find_root(parent, i * n + j)
+                    b = find_root(parent, ni * n + nj)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+
+    for k in range(n * n):
+        sizes[find_root(parent, k)] += 1
+    # heat-bath choice of every cluster's spin in the field B, stored in sizes
+    for k in range(n * n):
+        if sizes[k]:
+            p_up = 0.5 * (1 + np.tanh(beta * B * sizes[k]))
+            sizes[k] = 1 if np.random.random() < p_up else -1
+    for i in range(n):
+        for j in range(n):
+            grid[i, j] = sizes[parent[i * n + j]]
+    # every site may change, a full recount costs as much as the sweep itself
+    totals[0] = np.sum(grid)
+    totals[1] = total_energy(grid, n, J, B)
@@ -0,0 +1,230 @@
+import ast
+from functools import lru_cache
+import hashlib
+import importlib.util
+import os
+import sys
+import numpy as np
+
+# generated kernels live next to the bytecode cache, numba caches their
+# compiled code in turn, so an expression is compiled once per machine
+KERNEL_DIR = os.path.join(os.path.dirname(__file__), "__pycache__", "hamiltonians")
+
+FUNCTIONS = {"sin", "cos", "tan", "exp", "log", "sqrt", "tanh", "cosh", "sinh"}
+CONSTANTS = {"pi", "e"}
+COORDINATES = {"i", "j", "n"}
+OPERATORS = (
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.Pow,
+    ast.USub,
+    ast.UAdd,
+    ast.Load,
+)
+
+
+def spin_offset(node):
+    # s[dx, dy] with integer constants, the spin dx rows and dy columns away
+    if not (
+        isinstance(node.value, ast.Name)
+        and node.value.id == "s"
+        and isinstance(node.slice, ast.Tuple)
+        and len(node.slice.elts) == 2
+    ):
+        raise ValueError(f"Expected s[dx, dy], got {ast.unparse(node)}")
+    offset = []
+    for element in node.slice.elts:
+        try:
+            value = ast.literal_eval(element)
+        except ValueError:
+            value = None
+        if not isinstance(value, int):
+            raise ValueError(f"Spin offsets must be integers: {ast.unparse(node)}")
+        offset.append(value)
+
+    return tuple(offset)
+
+
+def parse(expression):
+    # energy of the site (i, j) as a function of the spins s[dx, dy] around it,
+    # the total energy is its sum over all sites
+    tree = ast.parse(expression, mode="eval")
+    offsets = set()
+    parameters = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Subscript):
+            offsets.add(spin_offset(node))
+        elif isinstance(node, ast.Call):
+            if not (
+                isinstance(node.func, ast.Name)
+                and node.func.id in FUNCTIONS | {"abs"}
+                and not node.keywords
+            ):
+                raise ValueError(f"Unsupported call: {ast.unparse(node)}")
+        elif isinstance(node, ast.Name):
+            if node.id not in FUNCTIONS | CONSTANTS | COORDINATES | {"s", "abs"}:
+                parameters.add(node.id)
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)):
+                raise ValueError(f"Unsupported constant: {ast.unparse(node)}")
+        elif not isinstance(
+            node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Tuple) + OPERATORS
+        ):
+            raise ValueError(f"Unsupported syntax: {ast.unparse(node)}")
+    if not offsets:
+        raise ValueError("The Hamiltonian does not depend on the spins")
+
+    return tree, sorted(offsets), sorted(parameters)
+
+
+def shift(coordinate, offset):
+    if offset == 0:
+        return coordinate
+    sign = "+" if offset > 0 else "-"
+    return f"({coordinate} {sign} {abs(offset)}) % n"
+
+
+class Substitute(ast.NodeTransformer):
+    # rewrites the site energy for the site (x, y), the spin at flipped is
+    # replaced by the expression flip
+    def __init__(self, parameters, x, y, flipped=None, flip=None):
+        self.parameters = parameters
+        self.x = x
+        self.y = y
+        self.flipped = flipped
+        self.flip = flip
+
+    def visit_Subscript(self, node):
+        dx, dy = spin_offset(node)
+        if (dx, dy) == self.flipped:
+            return ast.parse(self.flip, mode="eval").body
+        return ast.parse(
+            f"grid[{shift(self.x, dx)}, {shift(self.y, dy)}]", mode="eval"
+        ).body
+
+    def visit_Call(self, node):
+        node.args = [self.visit(arg) for arg in node.args]
+        if node.func.id != "abs":
+            node.func = ast.parse(f"math.{node.func.id}", mode="eval").body
+        return node
+
+    def visit_Name(self, node):
+        if node.id == "i":
+            return ast.Name(self.x, ctx=ast.Load())
+        if node.id == "j":
+            return ast.Name(self.y, ctx=ast.Load())
+        if node.id in CONSTANTS:
+            return ast.parse(f"math.{node.id}", mode="eval").body
+        if node.id in self.parameters:
+            index = self.parameters.index(node.id)
+            return ast.parse(f"params[{index}]", mode="eval").body
+        return node
+
+
+def site_energy(tree, parameters, x, y, flipped=None, flip=None):
+    body = ast.parse(ast.unparse(tree), mode="eval")
+    body = Substitute(parameters, x, y, flipped, flip).visit(body)
+    return ast.unparse(ast.fix_missing_locations(body).body)
+
+
+def kernel_source(tree, offsets, parameters):
+    # flipping the spin at (i, j) changes the energies of the sites (i, j) - d
+    # for every offset d, everything else cancels in the energy difference
+    lines = [
+        "import math",
+        "import numpy as np",
+        "from numba import njit",
+        "",
+        f"# {ast.unparse(tree)}",
+        "",
+        "",
+        "@njit(cache=True)",
+        "def energy_change(grid, n, params, i, j):",
+        "    s = grid[i, j]",
+        "    dE = 0.0",
+    ]
+    for k, (dx, dy) in enumerate(offsets):
+        x, y = f"x{k}", f"y{k}"
+        before = site_energy(tree, parameters, x, y, (dx, dy), "s")
+        after = site_energy(tree, parameters, x, y, (dx, dy), "(-s)")
+        lines += [
+            f"    {x} = {shift('i', -dx)}",
+            f"    {y} = {shift('j', -dy)}",
+            f"    dE += ({after}) - ({before})",
+        ]
+    lines += [
+        "    return dE",
+        "",
+        "",
+        "@njit(cache=True)",
+        "def total_energy(grid, n, params):",
+        "    E = 0.0",
+        "    for x in range(n):",
+        "        for y in range(n):",
+        f"            E += {site_energy(tree, parameters, 'x', 'y')}",
+        "    return E",
+        "",
+        "",
+        "@njit(cache=True)",
+        "def monte_carlo_step(grid, n, params, beta, totals):",
+        "    for _ in range(n * n):",
+        "        i = np.random.randint(0, n)",
+        "        j = np.random.randint(0, n)",
+        "        dE = energy_change(grid, n, params, i, j)",
+        "        if dE < 0 or np.random.random() < np.exp(-beta * dE):",
+        "            totals[0] -= 2 * grid[i, j]",
+        "            totals[1] += dE",
+        "            grid[i, j] *= -1",
+        "",
+    ]
+
+    return "\n".join(lines)
+
+
+@lru_cache
+def load_kernels(source):
+    key = hashlib.sha256(source.encode()).hexdigest()[:16]
+    path = os.path.join(KERNEL_DIR, f"hamiltonian_{key}.py")
+    if not os.path.exists(path):
+        os.makedirs(KERNEL_DIR, exist_ok=True)
+        with open(f"{path}.{os.getpid()}", "w") as f:
+            f.write(source)
+        os.replace(f"{path}.{os.getpid()}", path)
+
+    # numba looks the module up by name when it loads cached code
+    spec = importlib.util.spec_from_file_location(f"hamiltonian_{key}", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+
+    return module
+
+
+class Hamiltonian:
+    # e.g. "-J * s[0, 0] * (s[1, 0] + s[0, 1]) - B * s[0, 0]" is the default
+    # model, every name other than s, i, j, n and math functions is a parameter
+    def __init__(self, expression, parameters, n):
+        tree, offsets, names = parse(expression)
+        missing = [name for name in names if name not in parameters]
+        if missing:
+            raise ValueError(f"Missing values of parameters: {', '.join(missing)}")
+        # the sites (i, j) - d must be distinct for the energy difference
+        reach = max(max(abs(dx), abs(dy)) for dx, dy in offsets)
+        if n <= 2 * reach:
+            raise ValueError(f"Grid size must exceed {2 * reach} for this Hamiltonian")
+
+        self.expression = ast.unparse(tree)
+        self.n = n
+        self.params = np.array([parameters[name] for name in names], dtype=float)
+        self.kernels = load_kernels(kernel_source(tree, offsets, names))
+
+    def energy(self, grid):
+        return self.kernels.total_energy(grid, self.n, self.params)
+
+    def energy_change(self, grid, i, j):
+        return self.kernels.energy_change(grid, self.n, self.params, i, j)
+
+    def monte_carlo_step(self, grid, beta, totals):
+        self.kernels.monte_carlo_step(grid, self.n, self.params, beta, totals)
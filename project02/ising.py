@@ -1,20 +1,11 @@
 import argparse
+from collections import deque
+from contextlib import nullcontext
+import queue
+import threading
 import numpy as np
-from PIL import Image, ImageDraw
-import rich
-from rich.progress import (
-    BarColumn,
-    MofNCompleteColumn,
-    Progress,
-    TextColumn,
-    TimeElapsedColumn,
-    TimeRemainingColumn,
-)
-import rich.traceback
-
-rich.traceback.install()
-rich.get_console().clear()
-rich.get_console().rule("Ising simulation", style="bold cyan")
+
+from hamiltonian import Hamiltonian
 
 
 def get_arguments():
@@ -78,17 +69,249 @@ def get_arguments():
         type=str,
         help="Animation filename (if not provided no animation saved)",
     )
+    parser.add_argument(
+        "--frame_stride",
+        "-fs",
+        type=int,
+        default=1,
+        help="Render every n-th step to images and animation (default 1).",
+    )
     parser.add_argument(
         "--magnetization_file",
         "-mf",
         type=str,
         help="Magnetization filename (if not provided no magnetization saved)",
     )
+    parser.add_argument(
+        "--mode",
+        "-m",
+        type=str,
+        choices=["random", "checkerboard", "wolff", "swendsen-wang"],
+        default="random",
+        help="Sweep mode: random single-site updates, vectorized checkerboard, "
+        "Wolff or Swendsen-Wang cluster updates (default random).",
+    )
+    parser.add_argument(
+        "--hamiltonian",
+        "-H",
+        type=str,
+        help="Energy of the site (i, j) in terms of the spins s[dx, dy] around it, "
+        'e.g. -H="-J * s[0, 0] * (s[1, 0] + s[0, 1]) - B * s[0, 0]", compiled into '
+        "the random mode kernel (if not provided the built-in model is used).",
+    )
+    parser.add_argument(
+        "--parameters",
+        "-p",
+        nargs="+",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Values of the Hamiltonian parameters other than J and B.",
+    )
+    parser.add_argument(
+        "--thermalization",
+        "-th",
+        type=int,
+        default=0,
+        help="Number of macrosteps left out of the observables (default 0).",
+    )
+    parser.add_argument(
+        "--tolerance",
+        "-tol",
+        type=float,
+        help="Stop early when the mean magnetization of the last two windows "
+        "differs by less than tolerance (if not provided all steps are run).",
+    )
+    parser.add_argument(
+        "--window",
+        "-w",
+        type=int,
+        default=50,
+        help="Window of steps for the convergence check (default 50).",
+    )
+    parser.add_argument(
+        "--quiet",
+        "-q",
+        action="store_true",
+        help="No progress bar, only the requested files are written.",
+    )
     args = parser.parse_args()
 
     return args
 
 
+# spin -1 blue, spin 1 red
+PALETTE = [0, 0, 255, 255, 0, 0]
+
+
+class FrameWriter:
+    # renders frames on a background thread and appends them to the images and
+    # the animation as they come, so no frame history is kept in memory
+    def __init__(self, image_prefix, animation_file, size=1000):
+        self.image_prefix = image_prefix
+        self.animation = (
+            open(f"project02/out/{animation_file}", "wb") if animation_file else None
+        )
+        self.size = size
+        self.error = None
+        self.frames = queue.Queue(maxsize=16)
+        self.thread = threading.Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def put(self, step, grid):
+        self.frames.put((step, (grid > 0).astype(np.uint8)))
+
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
+        if self.animation:
+            if self.animation.tell():
+                self.animation.write(b";")
+            self.animation.close()
+        if self.error:
+            raise self.error
+
+    def write_frames(self):
+        # keep draining the queue after an error so put() never blocks
+        while (frame := self.frames.get()) is not None:
+            if self.error is None:
+                try:
+                    self.write_frame(*frame)
+                except Exception as error:
+                    self.error = error
+
+    def write_frame(self, step, spins):
+        from PIL import GifImagePlugin, Image
+
+        image = Image.frombytes("P", spins.shape[::-1], spins.tobytes())
+        image.putpalette(PALETTE)
+        image = image.resize((self.size, self.size), Image.NEAREST)
+        # the GIF frame goes first, save() leaves PNG encoder settings on image
+        if self.animation:
+            if not self.animation.tell():
+                header, _ = GifImagePlugin.getheader(image, info={"loop": 0})
+                self.animation.write(b"".join(header))
+            frame = GifImagePlugin.getdata(image, duration=100)
+            self.animation.write(b"".join(frame))
+        if self.image_prefix:
+            image.save(f"project02/out/{self.image_prefix}_{step}.png")
+
+
+def track(sequence, total, quiet=False):
+    # rich is only imported when the progress bar is shown
+    if quiet:
+        yield from sequence
+        return
+
+    from rich.progress import (
+        BarColumn,
+        MofNCompleteColumn,
+        Progress,
+        TextColumn,
+        TimeElapsedColumn,
+        TimeRemainingColumn,
+    )
+
+    progress_bar = Progress(
+        TextColumn("Simulating:"),
+        TextColumn("[bold green]{task.percentage:>3.0f}% "),
+        BarColumn(
+            bar_width=120,
+            style="black",
+            complete_style="bold blue",
+            finished_style="bold green",
+        ),
+        MofNCompleteColumn(),
+        TimeElapsedColumn(),
+        TextColumn("[bold black]/"),
+        TimeRemainingColumn(),
+    )
+    with progress_bar as p:
+        yield from p.track(sequence, total=total)
+
+
+WOLFF_CALIBRATION_SWEEPS = 10
+
+
+class Observables:
+    # running means of m, |m|, m^2, e, e^2 per site (Welford) plus a bounded
+    # number of bin averages for error estimates: once max_bins bins are full,
+    # neighbouring bins are merged and the bin size doubles
+    names = ("m", "|m|", "m^2", "e", "e^2")
+
+    def __init__(self, n, beta, max_bins=128):
+        self.sites = n * n
+        self.beta = beta
+        self.count = 0
+        self.mean = np.zeros(5)
+        self.m2 = np.zeros(5)
+        self.bins = np.zeros((max_bins, 5))
+        self.filled = 0
+        self.bin_size = 1
+        self.pending = np.zeros(5)
+        self.pending_count = 0
+
+    def push(self, magnetization, energy):
+        x = np.array(
+            [magnetization, abs(magnetization), magnetization**2, energy, energy**2]
+        )
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+        self.pending += x
+        self.pending_count += 1
+        if self.pending_count == self.bin_size:
+            self.bins[self.filled] = self.pending / self.bin_size
+            self.pending[:] = 0
+            self.pending_count = 0
+            self.filled += 1
+            if self.filled == len(self.bins):
+                half = len(self.bins) // 2
+                self.bins[:half] = 0.5 * (self.bins[0::2] + self.bins[1::2])
+                self.filled = half
+                self.bin_size *= 2
+
+    def susceptibility(self, mean):
+        return self.beta * self.sites * (mean[2] - mean[1] ** 2)
+
+    def specific_heat(self, mean):
+        return self.beta**2 * self.sites * (mean[4] - mean[3] ** 2)
+
+    def summary(self):
+        # (value, error) pairs, errors of the derived quantities come from a
+        # jackknife over the bins
+        if self.filled < 2:
+            raise ValueError("Not enough samples for error estimates")
+        bins = self.bins[: self.filled]
+        errors = bins.std(axis=0, ddof=1) / np.sqrt(self.filled)
+        jackknife = (bins.sum(axis=0) - bins) / (self.filled - 1)
+
+        def jackknife_error(estimator):
+            values = [estimator(sample) for sample in jackknife]
+            return np.sqrt((self.filled - 1) * np.var(values))
+
+        summary = {
+            name: (self.mean[k], errors[k]) for k, name in enumerate(self.names)
+        }
+        summary["chi"] = (
+            self.susceptibility(self.mean),
+            jackknife_error(self.susceptibility),
+        )
+        summary["C"] = (
+            self.specific_heat(self.mean),
+            jackknife_error(self.specific_heat),
+        )
+
+        return summary
+
+
 class IsingModel:
     def __init__(self, args):
         self.n = args.number
@@ -99,13 +322,76 @@ class IsingModel:
         self.spin_density = args.density
         self.image_prefix = args.image_prefix
         self.animation_file = args.animation_file
+        self.frame_stride = args.frame_stride
         self.magnetization_file = args.magnetization_file
+        self.mode = args.mode
+        self.thermalization = args.thermalization
+        self.tolerance = args.tolerance
+        self.window = args.window
+        self.quiet = args.quiet
+
+        self.hamiltonian = None
+        if args.hamiltonian:
+            if self.mode != "random":
+                raise ValueError("A custom Hamiltonian requires the random mode")
+            parameters = {"J": self.J, "B": self.B}
+            for parameter in args.parameters:
+                name, value = parameter.split("=")
+                parameters[name.strip()] = float(value)
+            self.hamiltonian = Hamiltonian(args.hamiltonian, parameters, self.n)
 
         self.grid = np.random.choice(
             [-1, 1], size=(self.n, self.n), p=[1 - args.density, args.density]
         )
+        # total magnetization and energy, kept up to date by the sweeps
+        self.M = np.sum(self.grid)
+        self.E = self.energy()
+
+        if self.mode == "checkerboard":
+            if self.n % 2:
+                raise ValueError("Checkerboard mode requires an even grid size")
+            parity = np.add.outer(np.arange(self.n), np.arange(self.n)) % 2
+            self.sublattices = (parity == 0, parity == 1)
+
+        if self.mode in ("wolff", "swendsen-wang"):
+            if self.J <= 0:
+                raise ValueError("Cluster updates require a ferromagnetic J > 0")
+            self.p_add = 1 - np.exp(-2 * self.beta * self.J)
+            self.totals = np.array([self.M, self.E], dtype=float)
+
+        if self.mode == "wolff":
+            # numba is only imported by the cluster modes
+            from clusters import wolff_calibrate
+
+            self.stack = np.empty(self.n * self.n, dtype=np.int64)
+            self.cluster = np.empty(self.n * self.n, dtype=np.int64)
+            self.in_cluster = np.zeros((self.n, self.n), dtype=np.bool_)
+            # the number of clusters per sweep is fixed before the first step,
+            # calibration sweeps also thermalize the lattice and are not yielded
+            for _ in range(WOLFF_CALIBRATION_SWEEPS):
+                self.clusters_per_sweep = wolff_calibrate(
+                    self.grid,
+                    self.n,
+                    self.J,
+                    self.B,
+                    self.p_add,
+                    self.beta,
+                    self.stack,
+                    self.cluster,
+                    self.in_cluster,
+                    self.totals,
+                )
+            self.M, self.E = self.totals
+
+        if self.mode == "swendsen-wang":
+            self.parent = np.empty(self.n * self.n, dtype=np.int64)
+            self.sizes = np.empty(self.n * self.n, dtype=np.int64)
 
-        self.magnetization = []
+    def energy(self):
+        if self.hamiltonian:
+            return self.hamiltonian.energy(self.grid)
+        neighbors = np.roll(self.grid, 1, axis=0) + np.roll(self.grid, 1, axis=1)
+        return -np.sum(self.grid * (self.J * neighbors + self.B))
 
     def energy_change(self, i, j):
         spin = self.grid[i, j]
@@ -123,60 +409,147 @@ class IsingModel:
             i, j = np.random.randint(0, self.n, size=2)
             dE = self.energy_change(i, j)
             if dE < 0 or np.random.rand() < np.exp(-self.beta * dE):
+                self.M -= 2 * self.grid[i, j]
+                self.E += dE
                 self.grid[i, j] *= -1
 
-    def simulate(self):
-        progress_bar = Progress(
-            TextColumn("Simulating:"),
-            TextColumn("[bold green]{task.percentage:>3.0f}% "),
-            BarColumn(
-                bar_width=120,
-                style="black",
-                complete_style="bold blue",
-                finished_style="bold green",
+    def hamiltonian_step(self):
+        totals = np.array([self.M, self.E], dtype=float)
+        self.hamiltonian.monte_carlo_step(self.grid, self.beta, totals)
+        self.M, self.E = totals
+
+    def checkerboard_step(self):
+        for mask in self.sublattices:
+            neighbors = (
+                np.roll(self.grid, 1, axis=0)
+                + np.roll(self.grid, -1, axis=0)
+                + np.roll(self.grid, 1, axis=1)
+                + np.roll(self.grid, -1, axis=1)
+            )
+            dE = 2 * self.grid * (self.J * neighbors + self.B)
+            accept = np.random.rand(self.n, self.n) < np.exp(
+                -self.beta * np.maximum(dE, 0)
+            )
+            flip = mask & accept
+            self.M -= 2 * np.sum(self.grid[flip])
+            self.E += np.sum(dE[flip])
+            self.grid[flip] *= -1
+
+    def wolff_step(self):
+        from clusters import wolff_step
+
+        wolff_step(
+            self.grid,
+            self.n,
+            self.J,
+            self.B,
+            self.p_add,
+            self.beta,
+            self.clusters_per_sweep,
+            self.stack,
+            self.cluster,
+            self.in_cluster,
+            self.totals,
+        )
+        self.M, self.E = self.totals
+
+    def swendsen_wang_step(self):
+        from clusters import swendsen_wang_step
+
+        swendsen_wang_step(
+            self.grid,
+            self.n,
+            self.J,
+            self.B,
+            self.p_add,
+            self.beta,
+            self.parent,
+            self.sizes,
+            self.totals,
+        )
+        self.M, self.E = self.totals
+
+    def iter_steps(self):
+        # yields the state after every step, the grid is the live lattice so
+        # consumers that keep it past the next step have to copy it
+        sweep = {
+            "random": (
+                self.hamiltonian_step if self.hamiltonian else self.monte_carlo_step
             ),
-            MofNCompleteColumn(),
-            TimeElapsedColumn(),
-            TextColumn("[bold black]/"),
-            TimeRemainingColumn(),
+            "checkerboard": self.checkerboard_step,
+            "wolff": self.wolff_step,
+            "swendsen-wang": self.swendsen_wang_step,
+        }[self.mode]
+        recent = deque(maxlen=2 * self.window)
+        for step in range(self.steps):
+            sweep()
+            magnetization = self.M / (self.n * self.n)
+            yield {
+                "step": step,
+                "magnetization": magnetization,
+                "energy": self.E / (self.n * self.n),
+                "grid": self.grid,
+            }
+
+            recent.append(magnetization)
+            if self.tolerance is not None and len(recent) == recent.maxlen:
+                previous = np.mean(list(recent)[: self.window])
+                last = np.mean(list(recent)[self.window :])
+                if abs(last - previous) < self.tolerance:
+                    return
+
+    def simulate(self):
+        magnetization_file = (
+            open(f"project02/out/{self.magnetization_file}", "w")
+            if self.magnetization_file
+            else nullcontext()
         )
-        images = []
-        with progress_bar as p:
-            for step in p.track(range(self.steps)):
-                self.monte_carlo_step()
-                magnetization = np.sum(self.grid) / (self.n * self.n)
-                self.magnetization.append(magnetization)
-
-                if self.animation_file or self.image_prefix:
-                    image = Image.new("RGB", (self.n, self.n))
-                    draw = ImageDraw.Draw(image)
-                    for i in range(self.n):
-                        for j in range(self.n):
-                            color = (255, 0, 0) if self.grid[i, j] == 1 else (0, 0, 255)
-                            draw.point((j, i), fill=color)
-
-                    image = image.resize((1000, 1000), Image.NEAREST)
-                    images.append(image)
-                    if self.image_prefix:
-                        image.save(f"project02/out/{self.image_prefix}_{step}.png")
-
-        if self.animation_file:
-            images[0].save(
-                f"project02/out/{self.animation_file}",
-                save_all=True,
-                append_images=images[1:],
-                duration=100,
-                loop=0,
-            )
 
-        if self.magnetization_file:
-            with open(f"project02/out/{self.magnetization_file}", "w") as f:
-                for step, m in enumerate(self.magnetization):
-                    f.write(f"{step}\t{m}\n")
+        render = self.animation_file or self.image_prefix
+        frame_writer = (
+            FrameWriter(self.image_prefix, self.animation_file)
+            if render
+            else nullcontext()
+        )
+
+        observables = Observables(self.n, self.beta)
+        with magnetization_file, frame_writer:
+            for state in track(self.iter_steps(), self.steps, self.quiet):
+                step = state["step"]
+                if step >= self.thermalization:
+                    observables.push(state["magnetization"], state["energy"])
+                if self.magnetization_file:
+                    magnetization_file.write(f"{step}\t{state['magnetization']}\n")
+
+                if render and step % self.frame_stride == 0:
+                    frame_writer.put(step, state["grid"])
+
+        if self.quiet or observables.filled < 2:
+            return observables
+
+        import rich
+        from rich.table import Table
+
+        table = Table(title="Observables per site")
+        table.add_column("Observable")
+        table.add_column("Value", justify="right")
+        table.add_column("Error", justify="right")
+        for name, (value, error) in observables.summary().items():
+            table.add_row(name, f"{value:.6g}", f"{error:.2g}")
+        rich.print(table)
 
+        return observables
 
-args = get_arguments()
-ising = IsingModel(args)
-ising.simulate()
+if __name__ == "__main__":
+    args = get_arguments()
+    if args.quiet:
+        IsingModel(args).simulate()
+    else:
+        import rich
+        import rich.traceback
 
-rich.get_console().rule("Completed!", style="bold cyan")
+        rich.traceback.install()
+        rich.get_console().clear()
+        rich.get_console().rule("Ising simulation", style="bold cyan")
+        IsingModel(args).simulate()
+        rich.get_console().rule("Completed!", style="bold cyan")
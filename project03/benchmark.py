@@ -0,0 +1,375 @@
+# poetry run python project03/benchmark.py -rf baseline.json
+# poetry run python project03/benchmark.py -bm svd ising -bl baseline.json
+
+import argparse
+import datetime
+import gc
+import importlib
+import json
+import math
+import os
+import platform
+import sys
+import time
+import numpy as np
+import rich
+from rich.progress import track
+from rich.table import Table
+import rich.traceback
+
+from decorators import CacheDecorator, TimerDecorator
+
+rich.traceback.install()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+OUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "out")
+
+
+def import_from(project, module):
+    # the projects are directories of scripts, not packages
+    sys.path.insert(0, os.path.join(ROOT, project))
+    return importlib.import_module(module)
+
+
+def long_time_function():
+    np.random.seed(123)
+    matrix = np.random.rand(1000, 1000)
+    return np.linalg.svd(matrix)
+
+
+def svd():
+    return long_time_function
+
+
+def svd_cached():
+    return CacheDecorator()(long_time_function)
+
+
+def ising():
+    ising = import_from("project02", "ising")
+    np.random.seed(0)
+    model = ising.IsingModel(
+        argparse.Namespace(
+            number=64,
+            j_value=1,
+            beta=0.4407,
+            B_value=0,
+            steps=0,
+            density=0.5,
+            image_prefix=None,
+            animation_file=None,
+            frame_stride=1,
+            magnetization_file=None,
+            mode="checkerboard",
+            thermalization=0,
+            tolerance=None,
+            window=1,
+            hamiltonian=None,
+            parameters=[],
+            quiet=True,
+        )
+    )
+    return model.checkerboard_step
+
+
+def numba_ising():
+    numba_ising = import_from("project04", "numba_ising")
+    lattice, sweep, _, _ = numba_ising.prepare(
+        argparse.Namespace(
+            number=256,
+            j_value=1,
+            beta=0.4407,
+            B_value=0,
+            density=0.5,
+            mode="table",
+            threads=None,
+            seed=0,
+        )
+    )
+    return lambda: sweep(lattice)
+
+
+def word_count():
+    console = import_from("project01", "console")
+    filename = os.path.join(
+        ROOT, "project01", "books", "The_Way_of_Kings-Sanderson-Brandon.txt"
+    )
+    chunks = [words for words, _ in console.iter_words(filename)]
+
+    def count():
+        counter = console.TokenCounter()
+        for words in chunks:
+            counter.update(words)
+        return counter.counts()
+
+    return count
+
+
+def sir():
+    # importing the bokeh app builds its document, which needs no server
+    bokeh_proj = import_from("project09", "bokeh_proj")
+    return lambda: bokeh_proj.simulate_sir(0.3, 0.1, 0.99, 0.01, 0.0, 100)
+
+
+# name -> setup returning the function to time, setup is not timed
+BENCHMARKS = {
+    "svd": svd,
+    "svd_cached": svd_cached,
+    "ising": ising,
+    "numba_ising": numba_ising,
+    "word_count": word_count,
+    "sir": sir,
+}
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Benchmarks of the projects")
+    parser.add_argument(
+        "--benchmarks",
+        "-bm",
+        nargs="+",
+        choices=list(BENCHMARKS),
+        default=list(BENCHMARKS),
+        help="Benchmarks to run (default all).",
+    )
+    parser.add_argument(
+        "--warm_up",
+        "-wu",
+        type=int,
+        default=1,
+        help="Number of untimed calls before timing (default 1).",
+    )
+    parser.add_argument(
+        "--repeats",
+        "-rp",
+        type=int,
+        default=10,
+        help="Number of timed repeats (default 10).",
+    )
+    parser.add_argument(
+        "--min_time",
+        "-mt",
+        type=float,
+        default=0.2,
+        help="Minimal duration of a repeat in seconds, short functions are called "
+        "several times per repeat (default 0.2).",
+    )
+    parser.add_argument(
+        "--gc",
+        action="store_true",
+        help="Keep the garbage collector enabled while timing.",
+    )
+    parser.add_argument(
+        "--results_file",
+        "-rf",
+        type=str,
+        help="Results filename (if not provided results only printed)",
+    )
+    parser.add_argument(
+        "--baseline",
+        "-bl",
+        type=str,
+        help="Results file of an earlier run to compare against.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        "-tol",
+        type=float,
+        default=0.05,
+        help="Relative slowdown against the baseline ignored (default 0.05).",
+    )
+    parser.add_argument(
+        "--alpha",
+        "-a",
+        type=float,
+        default=0.01,
+        help="Significance level of the slowdown test (default 0.01).",
+    )
+    return parser.parse_args()
+
+
+def autorange(func, min_time):
+    # calls per repeat, 1, 2, 5, 10, 20, ... until a repeat lasts min_time
+    number = 1
+    while True:
+        for calls in (number, 2 * number, 5 * number):
+            start = time.perf_counter()
+            for _ in range(calls):
+                func()
+            if time.perf_counter() - start >= min_time:
+                return calls
+        number *= 10
+
+
+def run_benchmark(func, warm_up, repeats, min_time, keep_gc=False):
+    # per call statistics of the repeats, every repeat is one sample
+    for _ in range(warm_up):
+        func()
+    calls = autorange(func, min_time)
+
+    timer = TimerDecorator()
+
+    @timer
+    def repeat():
+        for _ in range(calls):
+            func()
+
+    enabled = gc.isenabled()
+    try:
+        for _ in range(repeats):
+            gc.collect()
+            if not keep_gc:
+                gc.disable()
+            repeat()
+            if enabled:
+                gc.enable()
+    finally:
+        if enabled:
+            gc.enable()
+
+    summary = timer.summary()
+    if not summary:
+        raise ValueError("No recordings, is PROFILING=0 set?")
+    stats = next(iter(summary.values()))
+    result = {"calls": calls, "repeats": stats["count"]}
+    for name in ("mean", "stdev", "min", "max", "p50"):
+        result[name] = stats[name] / calls
+    return result
+
+
+def incomplete_beta(x, a, b):
+    # regularized incomplete beta function, continued fraction of Lentz
+    if x <= 0 or x >= 1:
+        return float(x >= 1)
+    if x > (a + 1) / (a + b + 2):
+        return 1 - incomplete_beta(1 - x, b, a)
+    front = math.exp(
+        math.lgamma(a + b)
+        - math.lgamma(a)
+        - math.lgamma(b)
+        + a * math.log(x)
+        + b * math.log(1 - x)
+    )
+    tiny = 1e-300
+    c, d, f = 1.0, 0.0, 1.0
+    for i in range(400):
+        m = i // 2
+        if i == 0:
+            numerator = 1.0
+        elif i % 2:
+            numerator = -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))
+        else:
+            numerator = m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m))
+        d = 1 + numerator * d
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = 1 + numerator / c
+        c = c if abs(c) > tiny else tiny
+        f *= c * d
+        if abs(1 - c * d) < 1e-12:
+            break
+    return front * (f - 1) / a
+
+
+def welch_test(result, base):
+    # one-sided p-value of Welch's t-test that result is slower than base
+    variance = result["stdev"] ** 2 / result["repeats"]
+    base_variance = base["stdev"] ** 2 / base["repeats"]
+    delta = result["mean"] - base["mean"]
+    if variance + base_variance == 0:
+        return 0.0 if delta > 0 else 1.0
+    t = delta / math.sqrt(variance + base_variance)
+    # Welch-Satterthwaite degrees of freedom
+    df = (variance + base_variance) ** 2 / (
+        variance**2 / max(result["repeats"] - 1, 1)
+        + base_variance**2 / max(base["repeats"] - 1, 1)
+    )
+    tail = 0.5 * incomplete_beta(df / (df + t * t), df / 2, 0.5)
+    return tail if t > 0 else 1 - tail
+
+
+def compare(results, baseline, tolerance, alpha):
+    # a slowdown above tolerance that is also statistically significant
+    regressions = []
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        result["vs_baseline"] = result["mean"] / base["mean"]
+        result["p_value"] = welch_test(result, base)
+        if result["vs_baseline"] > 1 + tolerance and result["p_value"] < alpha:
+            regressions.append(name)
+
+    return regressions
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+
+if __name__ == "__main__":
+    rich.get_console().rule("Benchmarks", style="bold cyan")
+    args = get_arguments()
+
+    results = {}
+    for name in track(args.benchmarks, description="Benchmarking:"):
+        try:
+            func = BENCHMARKS[name]()
+        except ImportError as error:
+            rich.print(f"[yellow]Skipped {name}: {error}")
+            continue
+        results[name] = run_benchmark(
+            func, args.warm_up, args.repeats, args.min_time, args.gc
+        )
+
+    regressions = []
+    if args.baseline:
+        with open(os.path.join(OUT, args.baseline)) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.alpha)
+
+    table = Table(title=f"Time per call, {args.repeats} repeats")
+    table.add_column("benchmark")
+    for column in ("calls", "mean", "stdev", "min", "baseline", "p-value"):
+        table.add_column(column, justify="right")
+    for name, result in results.items():
+        ratio = result.get("vs_baseline")
+        table.add_row(
+            name,
+            f"{result['calls']}",
+            *(format_time(result[key]) for key in ("mean", "stdev", "min")),
+            "-" if ratio is None else f"{ratio:.2f}x",
+            "-" if ratio is None else f"{result['p_value']:.2g}",
+            style="red" if name in regressions else None,
+        )
+    rich.print(table)
+
+    if args.results_file:
+        machine = {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cores": os.cpu_count(),
+        }
+        os.makedirs(OUT, exist_ok=True)
+        with open(os.path.join(OUT, args.results_file), "w") as f:
+            json.dump(
+                {
+                    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "machine": machine,
+                    "arguments": vars(args),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if regressions:
+        rich.print(
+            f"[bold red]{len(regressions)} regressions significantly slower than "
+            f"the baseline by more than {args.tolerance:.0%}"
+        )
+    rich.get_console().rule("Completed!", style="bold cyan")
+    sys.exit(1 if regressions else 0)
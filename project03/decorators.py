@@ -1,43 +1,365 @@
+import hashlib
+import inspect
+import json
+import math
+import os
+import pickle
+import sys
+import threading
 import time
+from collections import OrderedDict
 import numpy as np
-from statistics import mean, stdev
 from functools import wraps
 
+
+class Stats:
+    # streaming statistics of one function, memory does not grow with the
+    # number of calls: running mean and variance and a log-bucket sketch of
+    # the distribution, quantiles are within ACCURACY of the true value
+    ACCURACY = 0.01
+    GAMMA = (1 + ACCURACY) / (1 - ACCURACY)
+    # samples are appended to a list, atomic under the GIL, and folded into
+    # the statistics in batches under the lock
+    BATCH = 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.total = 0.0
+        self.buckets = {}
+
+    def record(self, elapsed_time):
+        self.pending.append(elapsed_time)
+        if len(self.pending) >= self.BATCH:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            # samples appended meanwhile stay in the list for the next batch
+            samples = np.array(self.pending)
+            del self.pending[: len(samples)]
+            if not len(samples):
+                return
+            # Chan's combination of the batch with the running moments
+            count = self.count + len(samples)
+            mean = samples.mean()
+            delta = mean - self.mean
+            self.m2 += ((samples - mean) ** 2).sum()
+            self.m2 += delta**2 * self.count * len(samples) / count
+            self.mean += delta * len(samples) / count
+            self.count = count
+            self.total += samples.sum()
+            self.min = min(self.min, samples.min())
+            self.max = max(self.max, samples.max())
+            # bucket k holds times in (GAMMA ** (k - 1), GAMMA ** k]
+            buckets = np.ceil(np.log(np.maximum(samples, 1e-9)) / math.log(self.GAMMA))
+            for bucket, n in zip(*np.unique(buckets.astype(int), return_counts=True)):
+                self.buckets[int(bucket)] = self.buckets.get(int(bucket), 0) + int(n)
+
+    def quantile(self, q):
+        rank = q * (self.count - 1)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen > rank:
+                # the middle of the bucket in relative terms
+                value = 2 * self.GAMMA**bucket / (self.GAMMA + 1)
+                return float(min(max(value, self.min), self.max))
+        return float(self.max)
+
+    def summary(self):
+        self.flush()
+        with self.lock:
+            return {
+                'count': self.count,
+                'total': float(self.total),
+                'mean': float(self.mean),
+                'stdev': math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0,
+                'min': float(self.min),
+                'max': float(self.max),
+                'p50': self.quantile(0.5),
+                'p95': self.quantile(0.95),
+                'p99': self.quantile(0.99),
+            }
+
+
 class TimerDecorator:
+    # PROFILING=0 in the environment returns the functions undecorated, so a
+    # disabled timer costs nothing, the enabled attribute switches recording
+    # off at run time at the cost of one attribute lookup per call
+    enabled = os.environ.get('PROFILING', '1') != '0'
+
     def __init__(self):
-        self.times = []
+        self.registry = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        with self.lock:
+            return self.registry.setdefault(name, Stats())
 
     def __call__(self, func):
+        if os.environ.get('PROFILING', '1') == '0':
+            return func
+        record = self.get(f'{func.__module__}.{func.__qualname__}').record
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return await func(*args, **kwargs)
+                start_time = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record(time.perf_counter() - start_time)
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
             start_time = time.perf_counter()
-            result = func(*args, **kwargs)
-            end_time = time.perf_counter()
-            elapsed_time = end_time - start_time
-            self.times.append(elapsed_time)
-            return result
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(time.perf_counter() - start_time)
         return wrapper
 
+    def summary(self):
+        with self.lock:
+            registry = dict(self.registry)
+        summary = {name: stats.summary() for name, stats in registry.items()}
+        return {name: values for name, values in summary.items() if values['count']}
+
+    def to_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
     def stats(self):
-        if not self.times:
+        summary = self.summary()
+        if not summary:
             raise ValueError('No recordings')
-        print('Time stats:')
-        print(f'{len(self.times) = }')
-        print(f'{mean(self.times) = }')
-        print(f'{min(self.times) = }')
-        print(f'{max(self.times) = }')
-        print(f'{stdev(self.times) = }')
-        
+        for name, values in summary.items():
+            print(f'Time stats of {name}:')
+            for key, value in values.items():
+                print(f'{key} = {value}')
+
+
+def update_key(key, value):
+    # arrays are hashed by content, containers element by element and
+    # everything else by its pickle
+    if isinstance(value, np.ndarray):
+        key.update(f'ndarray{value.dtype.str}{value.shape}'.encode())
+        if value.dtype.hasobject:
+            # the buffer holds object pointers, the elements are hashed instead
+            update_key(key, value.tolist())
+        else:
+            key.update(np.ascontiguousarray(value).data)
+    elif isinstance(value, (list, tuple)):
+        key.update(f'{type(value).__name__}{len(value)}'.encode())
+        for item in value:
+            update_key(key, item)
+    elif isinstance(value, dict):
+        key.update(f'dict{len(value)}'.encode())
+        for name in sorted(value, key=repr):
+            update_key(key, name)
+            update_key(key, value[name])
+    else:
+        key.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def size_of(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes + sys.getsizeof(value) * (value.base is None)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(size_of(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            size_of(name) + size_of(item) for name, item in value.items()
+        )
+    return sys.getsizeof(value)
 
-timer = TimerDecorator()
 
-@timer
-def long_time_function():
-    np.random.seed(123)
-    matrix = np.random.rand(1000, 1000)
-    return np.linalg.svd(matrix)
+class CacheDecorator:
+    # memoizes pure functions, entries are evicted least recently used first
+    # above max_entries or max_bytes and after ttl seconds, with a directory
+    # the results are pickled there too and survive the process, the same
+    # limits apply to the files: the modification time of a file is its write,
+    # the access time its last use
+    def __init__(self, max_entries=128, max_bytes=None, ttl=None, directory=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        # compute time of the hits, the latency the cache saved
+        self.saved_time = 0.0
 
-for _ in range(13):
-    long_time_function()
+    def key(self, func, args, kwargs):
+        key = hashlib.blake2b(digest_size=16)
+        key.update(f'{func.__module__}.{func.__qualname__}'.encode())
+        update_key(key, args)
+        update_key(key, kwargs)
+        return key.hexdigest()
 
-timer.stats()
\ No newline at end of file
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.pickle')
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and (self.ttl is None or time.monotonic() < entry[1]):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.saved_time += entry[3]
+                return entry
+            if entry:
+                self.remove(key)
+        if not self.directory:
+            return None
+
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+            if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                value, elapsed_time = pickle.load(f)
+            os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        self.put(key, value, elapsed_time, write=False)
+        with self.lock:
+            self.disk_hits += 1
+            self.saved_time += elapsed_time
+        return value, None, None, elapsed_time
+
+    def put(self, key, value, elapsed_time, write=True):
+        size = size_of(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, expires, size, elapsed_time)
+            self.size += size
+            while len(self.entries) > self.max_entries or (
+                self.max_bytes is not None and self.size > self.max_bytes
+            ):
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+        if write and self.directory:
+            path = self.path(key)
+            with open(f'{path}.{os.getpid()}', 'wb') as f:
+                pickle.dump((value, elapsed_time), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f'{path}.{os.getpid()}', path)
+            self.evict_files()
+
+    def remove(self, key):
+        self.size -= self.entries.pop(key)[2]
+
+    def evict_files(self):
+        # expired files go first, then the least recently used ones until the
+        # directory is within the limits, files of entries held in memory are
+        # taken as the most recently used
+        now = time.time()
+        with self.lock:
+            held = set(self.entries)
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.pickle'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            expired = self.ttl is not None and now - stat.st_mtime > self.ttl
+            used = entry.name[: -len('.pickle')] in held
+            files.append((not expired, used, stat.st_atime_ns, stat.st_size, entry.path))
+
+        count = len(files)
+        total = sum(size for *_, size, _ in files)
+        evicted = 0
+        for alive, _, _, size, path in sorted(files):
+            if alive and count <= self.max_entries and (
+                self.max_bytes is None or total <= self.max_bytes
+            ):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            count -= 1
+            total -= size
+            evicted += 1
+        with self.lock:
+            self.disk_evictions += evicted
+
+    def __call__(self, func):
+        # cached values are shared between callers and must not be mutated
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                key = self.key(func, args, kwargs)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                # arguments that cannot be hashed are not cached
+                return func(*args, **kwargs)
+            entry = self.get(key)
+            if entry:
+                return entry[0]
+            with self.lock:
+                self.misses += 1
+            start_time = time.perf_counter()
+            value = func(*args, **kwargs)
+            self.put(key, value, time.perf_counter() - start_time)
+            return value
+        wrapper.cache = self
+        return wrapper
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+        if self.directory:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.pickle'):
+                    os.remove(entry.path)
+
+    def summary(self):
+        with self.lock:
+            calls = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / calls if calls else 0.0,
+                'evictions': self.evictions,
+                'disk_evictions': self.disk_evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'saved_time': self.saved_time,
+            }
+
+    def stats(self):
+        print('Cache stats:')
+        for key, value in self.summary().items():
+            print(f'{key} = {value}')
+
+
+timer = TimerDecorator()
@@ -0,0 +1,107 @@
+# poetry run python project04/autocorrelation.py -n 64 -b 0.4407 -s 2000
+
+import argparse
+import time
+import numpy as np
+import rich
+from rich.table import Table
+import rich.traceback
+
+from numba_ising import integrated_autocorrelation_time, prepare
+
+rich.traceback.install()
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Autocorrelation comparison of Ising update algorithms"
+    )
+    parser.add_argument(
+        "--number", "-n", type=int, default=64, help="Size of grid (default 64)."
+    )
+    parser.add_argument(
+        "--j_value", "-J", type=float, default=1, help="Value of J (default 1)"
+    )
+    parser.add_argument(
+        "--beta",
+        "-b",
+        type=float,
+        default=0.4407,
+        help="Value of parameter Beta (default 0.4407, critical for J=1).",
+    )
+    parser.add_argument(
+        "--B_value", "-B", type=float, default=0, help="Value of field B (default 0)."
+    )
+    parser.add_argument(
+        "--steps",
+        "-s",
+        type=int,
+        default=2000,
+        help="Number of measured macrosteps (default 2000).",
+    )
+    parser.add_argument(
+        "--thermalization",
+        "-th",
+        type=int,
+        default=200,
+        help="Number of macrosteps discarded before measuring (default 200).",
+    )
+    parser.add_argument(
+        "--modes",
+        "-m",
+        nargs="+",
+        type=str,
+        default=["table", "parallel", "wolff", "swendsen-wang"],
+        help="Sweep kernels to compare (default table parallel wolff swendsen-wang).",
+    )
+    parser.add_argument("--seed", type=int, help="Random seed.")
+    args = parser.parse_args()
+
+    return args
+
+
+def measure_mode(args, mode):
+    run_args = argparse.Namespace(**vars(args), density=0.5, threads=None)
+    run_args.mode = mode
+    lattice, sweep, measure, _ = prepare(run_args)
+
+    for _ in range(args.thermalization):
+        lattice = sweep(lattice)
+
+    magnetizations = np.empty(args.steps)
+    start = time.perf_counter()
+    for step in range(args.steps):
+        lattice = sweep(lattice)
+        magnetizations[step], _ = measure(lattice)
+    elapsed = time.perf_counter() - start
+
+    tau = integrated_autocorrelation_time(np.abs(magnetizations))
+    return tau, elapsed, args.steps / (2 * tau) / elapsed
+
+
+if __name__ == "__main__":
+    rich.get_console().rule("Autocorrelation comparison", style="bold cyan")
+    args = get_arguments()
+
+    table = Table(
+        title=f"n={args.number}, J={args.j_value}, beta={args.beta}, B={args.B_value}"
+    )
+    table.add_column("Mode")
+    table.add_column("tau_int(|m|) [sweeps]", justify="right")
+    table.add_column("Time [s]", justify="right")
+    table.add_column("Effective samples/s", justify="right")
+    table.add_column("Speedup", justify="right")
+
+    results = {mode: measure_mode(args, mode) for mode in args.modes}
+    reference = results[args.modes[0]][2]
+    for mode, (tau, elapsed, rate) in results.items():
+        table.add_row(
+            mode,
+            f"{tau:.2f}",
+            f"{elapsed:.2f}",
+            f"{rate:,.1f}",
+            f"{rate / reference:.1f}x",
+        )
+
+    rich.print(table)
+    rich.get_console().rule("Completed!", style="bold cyan")
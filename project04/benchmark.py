@@ -0,0 +1,383 @@
+# poetry run python project04/benchmark.py -n 64 256 -b 0.3 0.4407 -rf bench.json
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import importlib
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import numpy as np
+import numba
+import rich
+from rich.progress import track
+from rich.table import Table
+import rich.traceback
+
+from numba_ising import close_shared_lattices, prepare
+
+rich.traceback.install()
+
+PROJECT02 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "project02")
+THREADED_MODES = ("parallel", "packed", "ensemble", "shared")
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark of the Ising kernels")
+    parser.add_argument(
+        "--sizes",
+        "-n",
+        nargs="+",
+        type=int,
+        default=[64, 128, 256],
+        help="Grid sizes (default 64 128 256).",
+    )
+    parser.add_argument(
+        "--j_value", "-J", type=float, default=1, help="Value of J (default 1)"
+    )
+    parser.add_argument(
+        "--betas",
+        "-b",
+        nargs="+",
+        type=float,
+        default=[0.3, 0.4407, 0.6],
+        help="Values of parameter Beta, hot, critical and cold by default.",
+    )
+    parser.add_argument(
+        "--B_value", "-B", type=float, default=0, help="Value of field B (default 0)."
+    )
+    parser.add_argument(
+        "--modes",
+        "-m",
+        nargs="*",
+        default=[
+            "random",
+            "table",
+            "parallel",
+            "packed",
+            "wolff",
+            "swendsen-wang",
+            "shared",
+        ],
+        help="Kernels of numba_ising (default all but ensemble).",
+    )
+    parser.add_argument(
+        "--numpy_modes",
+        "-nm",
+        nargs="*",
+        default=["random", "checkerboard"],
+        help="Sweep modes of the project02 IsingModel (default random checkerboard).",
+    )
+    parser.add_argument(
+        "--replicas",
+        "-r",
+        type=int,
+        default=16,
+        help="Number of lattices in ensemble mode (default 16).",
+    )
+    parser.add_argument(
+        "--threads",
+        "-t",
+        nargs="*",
+        type=int,
+        help="Thread (process in shared mode) counts of the scaling runs of the "
+        "multi-threaded kernels at the largest size (default powers of two up to "
+        "all cores).",
+    )
+    parser.add_argument(
+        "--repeats",
+        "-rp",
+        type=int,
+        default=5,
+        help="Number of timed repeats, the fastest one is reported (default 5).",
+    )
+    parser.add_argument(
+        "--min_time",
+        "-mt",
+        type=float,
+        default=0.2,
+        help="Minimal duration of a repeat in seconds (default 0.2).",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default 0).")
+    parser.add_argument(
+        "--results_file",
+        "-rf",
+        type=str,
+        help="Results filename (if not provided results only printed)",
+    )
+    parser.add_argument(
+        "--baseline",
+        "-bl",
+        type=str,
+        help="Results file of an earlier run to compare against.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        "-tol",
+        type=float,
+        default=0.1,
+        help="Relative slowdown against the baseline reported as a regression "
+        "(default 0.1).",
+    )
+    args = parser.parse_args()
+
+    if args.threads is None:
+        cores = numba.config.NUMBA_NUM_THREADS
+        args.threads = [2**k for k in range(cores.bit_length()) if 2**k < cores]
+        args.threads.append(cores)
+
+    return args
+
+
+def make_sweep(args, case):
+    if case["impl"] == "numba":
+        run_args = argparse.Namespace(
+            number=case["n"],
+            j_value=args.j_value,
+            beta=case["beta"],
+            B_value=args.B_value,
+            density=0.5,
+            mode=case["mode"],
+            replicas=args.replicas,
+            threads=None if case["mode"] == "shared" else case["threads"],
+            processes=case["threads"],
+            seed=args.seed,
+        )
+        lattice, sweep, _, _ = prepare(run_args)
+        return lattice, sweep
+
+    # project02 is a directory of scripts, not a package
+    sys.path.insert(0, PROJECT02)
+    ising = importlib.import_module("ising")
+    np.random.seed(args.seed)
+    model = ising.IsingModel(
+        argparse.Namespace(
+            number=case["n"],
+            j_value=args.j_value,
+            beta=case["beta"],
+            B_value=args.B_value,
+            steps=0,
+            density=0.5,
+            image_prefix=None,
+            animation_file=None,
+            frame_stride=1,
+            magnetization_file=None,
+            mode=case["mode"],
+            thermalization=0,
+            tolerance=None,
+            window=1,
+            hamiltonian=None,
+            parameters=[],
+            quiet=True,
+        )
+    )
+    step = {
+        "random": model.monte_carlo_step,
+        "checkerboard": model.checkerboard_step,
+        "wolff": model.wolff_step,
+        "swendsen-wang": model.swendsen_wang_step,
+    }[case["mode"]]
+
+    def sweep(grid):
+        step()
+        return model.grid
+
+    return model.grid, sweep
+
+
+def run_case(args, case):
+    # every case runs in a fresh process, so compilation and peak memory are
+    # its own and not left over from earlier cases
+    start = time.perf_counter()
+    lattice, sweep = make_sweep(args, case)
+    setup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lattice = sweep(lattice)
+    warm_up = time.perf_counter() - start
+
+    # enough sweeps per repeat to last min_time, based on the warm-up sweep
+    sweeps = max(1, int(np.ceil(args.min_time / max(warm_up, 1e-9))))
+    times = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        for _ in range(sweeps):
+            lattice = sweep(lattice)
+        times.append(time.perf_counter() - start)
+
+    threads = numba.get_num_threads() if case["impl"] == "numba" else 1
+    if case["mode"] == "shared":
+        threads = case["threads"] or os.cpu_count()
+        close_shared_lattices()
+
+    replicas = args.replicas if case["mode"] == "ensemble" else 1
+    flips = replicas * case["n"] ** 2 * sweeps
+    return {
+        **case,
+        "threads": threads,
+        "setup_s": setup,
+        "warm_up_s": warm_up,
+        "sweeps": sweeps,
+        "flips_per_s": flips / min(times),
+        "median_flips_per_s": flips / np.median(times),
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        / (2**20 if sys.platform == "darwin" else 2**10),
+    }
+
+
+def make_cases(args):
+    cases = []
+    skipped = []
+    modes = [("numba", mode) for mode in args.modes]
+    modes += [("numpy", mode) for mode in args.numpy_modes]
+    for impl, mode in modes:
+        for n in args.sizes:
+            if impl == "numba" and mode == "packed" and n % 64:
+                skipped.append(f"packed n={n}: size not divisible by 64")
+                continue
+            if mode in ("parallel", "shared", "checkerboard") and n % 2:
+                skipped.append(f"{mode} n={n}: odd size")
+                continue
+            for beta in args.betas:
+                case = {"impl": impl, "mode": mode, "n": n, "beta": beta}
+                cases.append({**case, "B": args.B_value, "threads": None})
+
+    # thread scaling at the largest size and the middle beta
+    n = max(args.sizes)
+    beta = sorted(args.betas)[len(args.betas) // 2]
+    for mode in args.modes:
+        if mode not in THREADED_MODES or (mode == "packed" and n % 64):
+            continue
+        for threads in args.threads:
+            case = {"impl": "numba", "mode": mode, "n": n, "beta": beta}
+            cases.append({**case, "B": args.B_value, "threads": threads})
+
+    return cases, skipped
+
+
+def key(result):
+    return (
+        result["impl"],
+        result["mode"],
+        result["n"],
+        result["beta"],
+        result["B"],
+        result["threads"],
+        result["scaling"],
+    )
+
+
+def compare(results, baseline, tolerance):
+    # ratio of throughput against the baseline, None if the case is new
+    reference = {key(result): result["flips_per_s"] for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = reference.get(key(result))
+        result["vs_baseline"] = result["flips_per_s"] / base if base else None
+        if base and result["vs_baseline"] < 1 - tolerance:
+            regressions.append(result)
+
+    return regressions
+
+
+if __name__ == "__main__":
+    rich.get_console().rule("Ising benchmark", style="bold cyan")
+    args = get_arguments()
+    cases, skipped = make_cases(args)
+    for reason in skipped:
+        rich.print(f"[yellow]Skipped {reason}")
+
+    results = []
+    for case in track(cases, description="Benchmarking:"):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(run_case, args, case).result()
+        result["scaling"] = case["threads"] is not None
+        results.append(result)
+
+    regressions = []
+    if args.baseline:
+        with open(f"project04/out/{args.baseline}") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    threads = max(
+        (result["threads"] for result in results if not result["scaling"]), default=1
+    )
+    table = Table(title=f"Throughput, fastest repeat, up to {threads} threads")
+    for column in ("impl", "mode", "n", "beta"):
+        table.add_column(column)
+    for column in ("setup [s]", "Mflips/s", "RSS [MB]", "baseline"):
+        table.add_column(column, justify="right")
+    for result in results:
+        if result["scaling"]:
+            continue
+        ratio = result.get("vs_baseline")
+        style = "red" if result in regressions else None
+        table.add_row(
+            result["impl"],
+            result["mode"],
+            f"{result['n']}",
+            f"{result['beta']:.4g}",
+            f"{result['setup_s']:.2f}",
+            f"{result['flips_per_s'] / 1e6:,.2f}",
+            f"{result['peak_rss_mb']:.0f}",
+            "-" if ratio is None else f"{ratio:.2f}x",
+            style=style,
+        )
+    rich.print(table)
+
+    scaling = [result for result in results if result["scaling"]]
+    if scaling:
+        table = Table(title="Thread scaling")
+        for column in ("mode", "n", "threads"):
+            table.add_column(column)
+        for column in ("Mflips/s", "speedup", "efficiency"):
+            table.add_column(column, justify="right")
+        single = {
+            result["mode"]: result["flips_per_s"]
+            for result in scaling
+            if result["threads"] == min(args.threads)
+        }
+        for result in scaling:
+            speedup = result["flips_per_s"] / single[result["mode"]]
+            table.add_row(
+                result["mode"],
+                f"{result['n']}",
+                f"{result['threads']}",
+                f"{result['flips_per_s'] / 1e6:,.2f}",
+                f"{speedup:.2f}x",
+                f"{speedup * min(args.threads) / result['threads']:.0%}",
+            )
+        rich.print(table)
+
+    if args.results_file:
+        machine = {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "numba": numba.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cores": os.cpu_count(),
+        }
+        with open(f"project04/out/{args.results_file}", "w") as f:
+            json.dump(
+                {
+                    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "machine": machine,
+                    "arguments": vars(args),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if regressions:
+        rich.print(
+            f"[bold red]{len(regressions)} regressions slower than the baseline "
+            f"by more than {args.tolerance:.0%}"
+        )
+    rich.get_console().rule("Completed!", style="bold cyan")
+    sys.exit(1 if regressions else 0)
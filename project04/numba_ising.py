@@ -1,21 +1,18 @@
 import argparse
+import atexit
+from contextlib import nullcontext
+from functools import partial
+import json
+import multiprocessing
+from multiprocessing import connection, shared_memory
+from operator import itemgetter
+import os
+import time
 import numpy as np
-from numba import njit
-from PIL import Image, ImageDraw
-import rich
-from rich.progress import (
-    BarColumn,
-    MofNCompleteColumn,
-    Progress,
-    TextColumn,
-    TimeElapsedColumn,
-    TimeRemainingColumn,
-)
-import rich.traceback
-
-rich.traceback.install()
-rich.get_console().clear()
-rich.get_console().rule("Ising simulation", style="bold cyan")
+import numba
+from numba import njit, prange
+import queue
+import threading
 
 
 def get_arguments():
@@ -79,33 +76,161 @@ def get_arguments():
         type=str,
         help="Animation filename (if not provided no animation saved)",
     )
+    parser.add_argument(
+        "--frame_stride",
+        "-fs",
+        type=int,
+        default=1,
+        help="Render every n-th step to images and animation (default 1).",
+    )
     parser.add_argument(
         "--magnetization_file",
         "-mf",
         type=str,
         help="Magnetization filename (if not provided no magnetization saved)",
     )
+    parser.add_argument(
+        "--mode",
+        "-m",
+        type=str,
+        choices=[
+            "random",
+            "table",
+            "parallel",
+            "packed",
+            "wolff",
+            "swendsen-wang",
+            "ensemble",
+            "shared",
+        ],
+        default="random",
+        help="Sweep kernel: serial random-site, serial random-site with precomputed "
+        "acceptance table, multi-threaded checkerboard, multi-threaded checkerboard "
+        "on a bit-packed lattice, Wolff or Swendsen-Wang cluster updates, an "
+        "ensemble of independent replicas or checkerboard over strips of a shared "
+        "memory lattice owned by worker processes (default random).",
+    )
+    parser.add_argument(
+        "--thermalization",
+        "-th",
+        type=int,
+        default=0,
+        help="Number of macrosteps left out of the observables (default 0).",
+    )
+    parser.add_argument(
+        "--replicas",
+        "-r",
+        type=int,
+        default=100,
+        help="Number of independent lattices in ensemble mode (default 100).",
+    )
+    parser.add_argument(
+        "--threads",
+        "-t",
+        type=int,
+        help="Number of threads for the parallel kernel (default all cores).",
+    )
+    parser.add_argument(
+        "--processes",
+        "-pr",
+        type=int,
+        help="Number of worker processes in shared mode (default all cores).",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Random seed (if not provided the run is not reproducible).",
+    )
+    parser.add_argument(
+        "--checkpoint_dir",
+        "-cd",
+        type=str,
+        help="Checkpoint directory (if not provided no checkpoints saved)",
+    )
+    parser.add_argument(
+        "--checkpoint_every",
+        "-ce",
+        type=int,
+        default=1000,
+        help="Macrosteps between checkpoints (default 1000).",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from the last checkpoint in the checkpoint directory.",
+    )
+    parser.add_argument(
+        "--quiet",
+        "-q",
+        action="store_true",
+        help="No progress bar and no summary, only the requested files are written.",
+    )
     args = parser.parse_args()
 
     return args
 
-def save_img(grid, n, step, image_prefix):
-    images = []
-    image = Image.new("RGB", (n, n))
-    draw = ImageDraw.Draw(image)
-    for i in range(n):
-        for j in range(n):
-            color = (255, 0, 0) if grid[i, j] == 1 else (0, 0, 255)
-            draw.point((j, i), fill=color)
+# spin -1 blue, spin 1 red
+PALETTE = [0, 0, 255, 255, 0, 0]
+
+class FrameWriter:
+    # renders frames on a background thread and appends them to the images and
+    # the animation as they come, so no frame history is kept in memory
+    def __init__(self, image_prefix, animation_file, size=1000):
+        self.image_prefix = image_prefix
+        self.animation = (
+            open(f"project04/out/{animation_file}", "wb") if animation_file else None
+        )
+        self.size = size
+        self.error = None
+        self.frames = queue.Queue(maxsize=16)
+        self.thread = threading.Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def put(self, step, grid):
+        self.frames.put((step, (grid > 0).astype(np.uint8)))
+
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
+        if self.animation:
+            if self.animation.tell():
+                self.animation.write(b";")
+            self.animation.close()
+        if self.error:
+            raise self.error
+
+    def write_frames(self):
+        # keep draining the queue after an error so put() never blocks
+        while (frame := self.frames.get()) is not None:
+            if self.error is None:
+                try:
+                    self.write_frame(*frame)
+                except Exception as error:
+                    self.error = error
 
-    image = image.resize((1000, 1000), Image.NEAREST)
-    images.append(image)
-    if image_prefix:
-        image.save(f"project04/out/{image_prefix}_{step}.png")
+    def write_frame(self, step, spins):
+        from PIL import GifImagePlugin, Image
 
-    return images
+        image = Image.frombytes("P", spins.shape[::-1], spins.tobytes())
+        image.putpalette(PALETTE)
+        image = image.resize((self.size, self.size), Image.NEAREST)
+        # the GIF frame goes first, save() leaves PNG encoder settings on image
+        if self.animation:
+            if not self.animation.tell():
+                header, _ = GifImagePlugin.getheader(image, info={"loop": 0})
+                self.animation.write(b"".join(header))
+            frame = GifImagePlugin.getdata(image, duration=100)
+            self.animation.write(b"".join(frame))
+        if self.image_prefix:
+            image.save(f"project04/out/{self.image_prefix}_{step}.png")
 
-@njit
+@njit(cache=True)
 def energy_change(grid, n, J, B, i, j):
     spin = grid[i, j]
     neighbors = (
@@ -116,17 +241,1064 @@ def energy_change(grid, n, J, B, i, j):
     )
     dE = 2 * spin * (J * neighbors + B)
     return dE
-@njit
-def monte_carlo_step(grid, n, J, B, beta):
+@njit(cache=True)
+def total_energy(grid, n, J, B):
+    energy = 0.0
+    for i in range(n):
+        for j in range(n):
+            neighbors = grid[(i + 1) % n, j] + grid[i, (j + 1) % n]
+            energy -= grid[i, j] * (J * neighbors + B)
+
+    return energy
+
+@njit(cache=True)
+def lattice_totals(grid, n, J, B):
+    return np.array([np.sum(grid) * 1.0, total_energy(grid, n, J, B)])
+
+# Kernels keep totals = [M, E] of their lattice up to date as spins flip.
+
+@njit(cache=True)
+def monte_carlo_step(grid, n, J, B, beta, totals):
     for _ in range(n * n):
         i, j = np.random.randint(0, n, size=2)
         dE = energy_change(grid, n, J, B, i, j)
         if dE < 0 or np.random.rand() < np.exp(-beta * dE):
+            totals[0] -= 2 * grid[i, j]
+            totals[1] += dE
             grid[i, j] *= -1
 
     return grid
 
-def simulate(self):
+def energy_table(J, B):
+    # dE only depends on the spin and the neighbour sum, see table_index
+    energies = np.empty(10)
+    for spin in (-1, 1):
+        for neighbors in range(-4, 5, 2):
+            energies[5 * ((spin + 1) // 2) + neighbors // 2 + 2] = (
+                2 * spin * (J * neighbors + B)
+            )
+
+    return energies
+
+def acceptance_table(J, B, beta):
+    return np.exp(-beta * np.maximum(energy_table(J, B), 0))
+
+@njit(cache=True)
+def table_index(grid, n, i, j):
+    spin = grid[i, j]
+    neighbors = (
+        grid[(i + 1) % n, j]
+        + grid[(i - 1) % n, j]
+        + grid[i, (j + 1) % n]
+        + grid[i, (j - 1) % n]
+    )
+    return 5 * ((spin + 1) // 2) + neighbors // 2 + 2
+
+@njit(cache=True)
+def fill_proposals(n, sites, uniforms):
+    for k in range(uniforms.size):
+        sites[k, 0] = np.random.randint(0, n)
+        sites[k, 1] = np.random.randint(0, n)
+        uniforms[k] = np.random.random()
+
+@njit(cache=True)
+def table_monte_carlo_step(grid, n, table, energies, sites, uniforms, totals):
+    fill_proposals(n, sites, uniforms)
+    for k in range(n * n):
+        i = sites[k, 0]
+        j = sites[k, 1]
+        index = table_index(grid, n, i, j)
+        if uniforms[k] < table[index]:
+            totals[0] -= 2 * grid[i, j]
+            totals[1] += energies[index]
+            grid[i, j] *= -1
+
+    return grid
+
+@njit(cache=True)
+def seed_numba(seed):
+    np.random.seed(seed)
+
+def make_streams(seed, count):
+    return np.random.SeedSequence(seed).generate_state(count, dtype=np.uint64)
+
+@njit(cache=True)
+def next_bits(states, k):
+    # splitmix64 step of stream k
+    states[k] += np.uint64(0x9E3779B97F4A7C15)
+    z = states[k]
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+@njit(cache=True)
+def next_uniform(states, k):
+    return (next_bits(states, k) >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+@njit(parallel=True, cache=True)
+def parallel_monte_carlo_step(grid, n, table, energies, rng_states, totals):
+    # rows of one sublattice are independent, every row owns its RNG stream
+    dM = 0.0
+    dE = 0.0
+    for color in range(2):
+        for i in prange(n):
+            for j in range((i + color) % 2, n, 2):
+                index = table_index(grid, n, i, j)
+                if next_uniform(rng_states, i) < table[index]:
+                    dM -= 2 * grid[i, j]
+                    dE += energies[index]
+                    grid[i, j] *= -1
+    totals[0] += dM
+    totals[1] += dE
+
+    return grid
+
+@njit(cache=True)
+def strip_monte_carlo_step(
+    grid, n, first, last, color, table, energies, rng_states, partials
+):
+    # one sublattice of the rows first..last-1, the same updates as in
+    # parallel_monte_carlo_step
+    for i in range(first, last):
+        for j in range((i + color) % 2, n, 2):
+            index = table_index(grid, n, i, j)
+            if next_uniform(rng_states, i) < table[index]:
+                partials[0] -= 2 * grid[i, j]
+                partials[1] += energies[index]
+                grid[i, j] *= -1
+
+@njit(parallel=True, cache=True)
+def ensemble_monte_carlo_step(grids, n, table, energies, rng_states, totals):
+    # random-site sweep of every replica, replica r owns RNG stream r and
+    # totals[r]
+    for r in prange(grids.shape[0]):
+        grid = grids[r]
+        for _ in range(n * n):
+            i = np.int64(next_uniform(rng_states, r) * n)
+            j = np.int64(next_uniform(rng_states, r) * n)
+            index = table_index(grid, n, i, j)
+            if next_uniform(rng_states, r) < table[index]:
+                totals[r, 0] -= 2 * grid[i, j]
+                totals[r, 1] += energies[index]
+                grid[i, j] *= -1
+
+    return grids
+
+@njit(parallel=True, cache=True)
+def ensemble_totals(grids, n, J, B):
+    totals = np.empty((grids.shape[0], 2))
+    for r in prange(grids.shape[0]):
+        totals[r] = lattice_totals(grids[r], n, J, B)
+
+    return totals
+
+# Bit-packed lattice: n % 64 == 0 and word (i, w) holds the spins (i, w + b * n // 64)
+# in bit b (1 = spin up), so every bit of a word belongs to a different column and
+# horizontal neighbours are the same bit of the next word (rotated at the edge).
+PACKED_PRECISION = 32
+ALL_BITS = np.uint64(0xFFFFFFFFFFFFFFFF)
+EVEN_BITS = np.uint64(0x5555555555555555)
+
+def packed_classes(table):
+    # (spin bit, anti-aligned neighbours) entry of a table in table_index layout
+    classes = np.empty((2, 5), dtype=table.dtype)
+    for k in range(5):
+        classes[0, k] = table[k]
+        classes[1, k] = table[9 - k]
+
+    return classes
+
+def packed_thresholds(table):
+    # acceptance probability of (spin bit, anti-aligned neighbours) in units of
+    # 2**-PACKED_PRECISION
+    return np.round(packed_classes(table) * 2**PACKED_PRECISION).astype(np.int64)
+
+@njit(cache=True)
+def popcount(x):
+    x = x - ((x >> np.uint64(1)) & EVEN_BITS)
+    x = (x & np.uint64(0x3333333333333333)) + (
+        (x >> np.uint64(2)) & np.uint64(0x3333333333333333)
+    )
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return np.int64((x * np.uint64(0x0101010101010101)) >> np.uint64(56))
+
+@njit(parallel=True, cache=True)
+def pack_random(n, density, rng_states):
+    words = np.zeros((n, n // 64), dtype=np.uint64)
+    for i in prange(n):
+        for w in range(n // 64):
+            word = np.uint64(0)
+            for b in range(64):
+                if next_uniform(rng_states, i) < density:
+                    word |= np.uint64(1) << np.uint64(b)
+            words[i, w] = word
+
+    return words
+
+@njit(cache=True)
+def unpack(words, n):
+    W = n // 64
+    grid = np.empty((n, n), dtype=np.int8)
+    for i in range(n):
+        for w in range(W):
+            for b in range(64):
+                bit = (words[i, w] >> np.uint64(b)) & np.uint64(1)
+                grid[i, w + b * W] = 1 if bit else -1
+
+    return grid
+
+@njit(parallel=True, cache=True)
+def packed_totals(words, n, J, B):
+    W = n // 64
+    up = 0
+    aligned = 0
+    for i in prange(n):
+        for w in range(W):
+            x = words[i, w]
+            right = words[i, w + 1] if w < W - 1 else rotate_right(words[i, 0])
+            up += popcount(x)
+            aligned += popcount(~(x ^ right)) + popcount(~(x ^ words[(i + 1) % n, w]))
+    M = 2 * up - n * n
+
+    return np.array([M * 1.0, -J * (2 * aligned - 2 * n * n) - B * M])
+
+@njit(cache=True)
+def rotate_right(x):
+    return (x >> np.uint64(1)) | (x << np.uint64(63))
+
+@njit(cache=True)
+def rotate_left(x):
+    return (x << np.uint64(1)) | (x >> np.uint64(63))
+
+@njit(cache=True)
+def color_lanes(i, w, W, color):
+    if W % 2 == 0:
+        return ALL_BITS if (i + w) % 2 == color else np.uint64(0)
+    return EVEN_BITS if (i + w + color) % 2 == 0 else ~EVEN_BITS
+
+@njit(cache=True)
+def bernoulli_lanes(lanes, threshold, rng_states, k):
+    # lanes whose PACKED_PRECISION-bit uniform, drawn bit-sliced from the most
+    # significant bit down, falls below threshold
+    if threshold >= 2**PACKED_PRECISION:
+        return lanes
+    accepted = np.uint64(0)
+    undecided = lanes
+    for t in range(PACKED_PRECISION - 1, -1, -1):
+        if undecided == 0:
+            break
+        u = next_bits(rng_states, k)
+        if (threshold >> t) & 1:
+            accepted |= undecided & ~u
+            undecided &= u
+        else:
+            undecided &= ~u
+
+    return accepted
+
+@njit(parallel=True, cache=True)
+def packed_monte_carlo_step(words, n, thresholds, energies, rng_states, totals):
+    W = n // 64
+    dM = 0.0
+    dE = 0.0
+    for color in range(2):
+        for i in prange(n):
+            for w in range(W):
+                x = words[i, w]
+                up = words[(i - 1) % n, w]
+                down = words[(i + 1) % n, w]
+                if w < W - 1:
+                    right = words[i, w + 1]
+                else:
+                    right = rotate_right(words[i, 0])
+                if w > 0:
+                    left = words[i, w - 1]
+                else:
+                    left = rotate_left(words[i, W - 1])
+
+                # bit-sliced count k2 k1 k0 of anti-aligned neighbours
+                a1 = x ^ up
+                a2 = x ^ down
+                a3 = x ^ left
+                a4 = x ^ right
+                s1 = a1 ^ a2
+                c1 = a1 & a2
+                s2 = a3 ^ a4
+                c2 = a3 & a4
+                k0 = s1 ^ s2
+                c3 = s1 & s2
+                k1 = c1 ^ c2 ^ c3
+                k2 = c1 & c2
+
+                lanes = color_lanes(i, w, W, color)
+                flips = np.uint64(0)
+                for k in range(5):
+                    count = (
+                        (k0 if k & 1 else ~k0)
+                        & (k1 if k & 2 else ~k1)
+                        & (k2 if k & 4 else ~k2)
+                        & lanes
+                    )
+                    for spin in range(2):
+                        candidates = count & (x if spin else ~x)
+                        if candidates:
+                            accepted = bernoulli_lanes(
+                                candidates, thresholds[spin, k], rng_states, i
+                            )
+                            flipped = popcount(accepted)
+                            dM += (2 - 4 * spin) * flipped
+                            dE += energies[spin, k] * flipped
+                            flips |= accepted
+                words[i, w] = x ^ flips
+    totals[0] += dM
+    totals[1] += dE
+
+    return words
+
+@njit(cache=True)
+def wolff_cluster(grid, n, J, B, p_add, beta, stack, cluster, in_cluster, totals):
+    i = np.random.randint(0, n)
+    j = np.random.randint(0, n)
+    spin = grid[i, j]
+    in_cluster[i, j] = True
+    cluster[0] = i * n + j
+    stack[0] = i * n + j
+    size = 1
+    top = 1
+    while top > 0:
+        top -= 1
+        i = stack[top] // n
+        j = stack[top] % n
+        for k in range(4):
+            if k == 0:
+                ni, nj = (i + 1) % n, j
+            elif k == 1:
+                ni, nj = (i - 1) % n, j
+            elif k == 2:
+                ni, nj = i, (j + 1) % n
+            else:
+                ni, nj = i, (j - 1) % n
+            if (
+                not in_cluster[ni, nj]
+                and grid[ni, nj] == spin
+                and np.random.random() < p_add
+            ):
+                in_cluster[ni, nj] = True
+                cluster[size] = ni * n + nj
+                stack[top] = ni * n + nj
+                size += 1
+                top += 1
+
+    dE = 2 * B * spin * size
+    flip = dE < 0 or np.random.random() < np.exp(-beta * dE)
+    if flip:
+        # only bonds across the cluster boundary change their energy
+        for k in range(size):
+            i = cluster[k] // n
+            j = cluster[k] % n
+            for ni, nj in (
+                ((i + 1) % n, j),
+                ((i - 1) % n, j),
+                (i, (j + 1) % n),
+                (i, (j - 1) % n),
+            ):
+                if not in_cluster[ni, nj]:
+                    dE += 2 * J * spin * grid[ni, nj]
+        totals[0] -= 2 * spin * size
+        totals[1] += dE
+    for k in range(size):
+        i = cluster[k] // n
+        j = cluster[k] % n
+        in_cluster[i, j] = False
+        if flip:
+            grid[i, j] *= -1
+
+    return size
+
+WOLFF_CALIBRATION_SWEEPS = 10
+
+@njit(cache=True)
+def wolff_calibrate(grid, n, J, B, p_add, beta, stack, cluster, in_cluster, totals):
+    # number of clusters needed to visit n*n sites, used as the fixed
+    # number of clusters per sweep (a state-dependent stopping rule is biased)
+    visited = 0
+    clusters = 0
+    while visited < n * n:
+        visited += wolff_cluster(
+            grid, n, J, B, p_add, beta, stack, cluster, in_cluster, totals
+        )
+        clusters += 1
+
+    return clusters
+
+@njit(cache=True)
+def wolff_step(
+    grid, n, J, B, p_add, beta, clusters, stack, cluster, in_cluster, totals
+):
+    for _ in range(clusters):
+        wolff_cluster(grid, n, J, B, p_add, beta, stack, cluster, in_cluster, totals)
+
+    return grid
+
+@njit(cache=True)
+def find_root(parent, k):
+    while parent[k] != k:
+        parent[k] = parent[parent[k]]
+        k = parent[k]
+
+    return k
+
+@njit(cache=True)
+def swendsen_wang_step(grid, n, J, B, p_add, beta, parent, sizes, totals):
+    for k in range(n * n):
+        parent[k] = k
+        sizes[k] = 0
+    for i in range(n):
+        for j in range(n):
+            for ni, nj in (((i + 1) % n, j), (i, (j + 1) % n)):
+                if grid[i, j] == grid[ni, nj] and np.random.random() < p_add:
+                    a = find_root(parent, i * n + j)
+                    b = find_root(parent, ni * n + nj)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+
+    for k in range(n * n):
+        sizes[find_root(parent, k)] += 1
+    # heat-bath choice of every cluster's spin in the field B, stored in sizes
+    for k in range(n * n):
+        if sizes[k]:
+            p_up = 0.5 * (1 + np.tanh(beta * B * sizes[k]))
+            sizes[k] = 1 if np.random.random() < p_up else -1
+    for i in range(n):
+        for j in range(n):
+            grid[i, j] = sizes[parent[i * n + j]]
+    # every site may change, a full recount costs as much as the sweep itself
+    totals[:] = lattice_totals(grid, n, J, B)
+
+    return grid
+
+@njit(cache=True)
+def accumulate(magnetizations, energies, mean, m2, bins, pending, counters):
+    # (steps, replicas) samples into the running moments and the bins, counters
+    # are the sample count, filled bins, bin size and steps pending in a bin
+    steps, replicas = magnetizations.shape
+    max_bins = bins.shape[0]
+    x = np.empty(5)
+    batch_mean = np.empty(5)
+    batch_m2 = np.empty(5)
+    for t in range(steps):
+        batch_mean[:] = 0
+        batch_m2[:] = 0
+        for r in range(replicas):
+            m = magnetizations[t, r]
+            e = energies[t, r]
+            x[0] = m
+            x[1] = abs(m)
+            x[2] = m * m
+            x[3] = e
+            x[4] = e * e
+            for k in range(5):
+                delta = x[k] - batch_mean[k]
+                batch_mean[k] += delta / (r + 1)
+                batch_m2[k] += delta * (x[k] - batch_mean[k])
+
+        # Chan's combination of the step's batch with the running moments
+        count = counters[0] + replicas
+        for k in range(5):
+            delta = batch_mean[k] - mean[k]
+            m2[k] += batch_m2[k] + delta * delta * counters[0] * replicas / count
+            mean[k] += delta * replicas / count
+            pending[k] += batch_mean[k]
+        counters[0] = count
+
+        # a step is one sample of the bins, replicas of a step are averaged
+        counters[3] += 1
+        if counters[3] == counters[2]:
+            for k in range(5):
+                bins[counters[1], k] = pending[k] / counters[2]
+                pending[k] = 0
+            counters[1] += 1
+            counters[3] = 0
+            if counters[1] == max_bins:
+                half = max_bins // 2
+                for b in range(half):
+                    for k in range(5):
+                        bins[b, k] = 0.5 * (bins[2 * b, k] + bins[2 * b + 1, k])
+                counters[1] = half
+                counters[2] *= 2
+
+class Observables:
+    # running means of m, |m|, m^2, e, e^2 per site (Welford) plus a bounded
+    # number of bin averages for error estimates: once max_bins bins are full,
+    # neighbouring bins are merged and the bin size doubles
+    names = ("m", "|m|", "m^2", "e", "e^2")
+
+    def __init__(self, n, beta, max_bins=128):
+        self.sites = n * n
+        self.beta = beta
+        self.max_bins = max_bins
+        self.mean = np.zeros(5)
+        self.m2 = np.zeros(5)
+        self.bins = np.zeros((max_bins, 5))
+        self.pending = np.zeros(5)
+        # count, filled, bin_size, pending steps, updated by accumulate
+        self.counters = np.array([0, 0, 1, 0], dtype=np.int64)
+        # a single lattice step is written here, no arrays built per call
+        self.step = np.zeros((2, 1, 1))
+
+    @property
+    def count(self):
+        return int(self.counters[0])
+
+    @property
+    def filled(self):
+        return int(self.counters[1])
+
+    def push(self, magnetization, energy):
+        # one step, of a single lattice or a batch of replicas
+        if np.ndim(magnetization):
+            self.extend(magnetization[None], energy[None])
+            return
+        self.step[0, 0, 0] = magnetization
+        self.step[1, 0, 0] = energy
+        step = self.step
+        accumulate(
+            step[0], step[1], self.mean, self.m2, self.bins, self.pending, self.counters
+        )
+
+    def extend(self, magnetizations, energies):
+        # a series of steps, (steps,) or (steps, replicas)
+        magnetizations = np.asarray(magnetizations, dtype=np.float64)
+        energies = np.asarray(energies, dtype=np.float64)
+        if not len(magnetizations):
+            return
+        accumulate(
+            magnetizations.reshape(len(magnetizations), -1),
+            energies.reshape(len(energies), -1),
+            self.mean,
+            self.m2,
+            self.bins,
+            self.pending,
+            self.counters,
+        )
+
+    def susceptibility(self, mean):
+        return self.beta * self.sites * (mean[2] - mean[1] ** 2)
+
+    def specific_heat(self, mean):
+        return self.beta**2 * self.sites * (mean[4] - mean[3] ** 2)
+
+    def summary(self):
+        # (value, error) pairs, errors of the derived quantities come from a
+        # jackknife over the bins, tau is estimated from the |m| error ratio
+        if self.filled < 2:
+            raise ValueError("Not enough samples for error estimates")
+        bins = self.bins[: self.filled]
+        errors = bins.std(axis=0, ddof=1) / np.sqrt(self.filled)
+        jackknife = (bins.sum(axis=0) - bins) / (self.filled - 1)
+
+        def jackknife_error(estimator):
+            values = [estimator(sample) for sample in jackknife]
+            return np.sqrt((self.filled - 1) * np.var(values))
+
+        summary = {
+            name: (self.mean[k], errors[k]) for k, name in enumerate(self.names)
+        }
+        summary["chi"] = (
+            self.susceptibility(self.mean),
+            jackknife_error(self.susceptibility),
+        )
+        summary["C"] = (
+            self.specific_heat(self.mean),
+            jackknife_error(self.specific_heat),
+        )
+        naive_error = np.sqrt(self.m2[1] / (self.count - 1) / self.count)
+        summary["tau(|m|)"] = (
+            0.5 * (errors[1] / naive_error) ** 2 if naive_error else 0.5,
+            np.nan,
+        )
+
+        return summary
+
+def integrated_autocorrelation_time(series, window=5):
+    # Sokal's automatic windowing: stop summing once t >= window * tau
+    x = np.asarray(series, dtype=float)
+    x = x - x.mean()
+    if len(x) < 2 or not np.any(x):
+        return 0.5
+    spectrum = np.fft.rfft(x, n=2 * len(x))
+    acf = np.fft.irfft(spectrum * np.conj(spectrum))[: len(x)]
+    acf /= acf[0]
+    tau = 0.5
+    for t in range(1, len(x)):
+        tau += acf[t]
+        if t >= window * tau:
+            break
+
+    return tau
+
+def attach(layout):
+    # numpy views of the shared blocks of a SharedLattice
+    blocks = {}
+    arrays = {}
+    for name, (block_name, shape, dtype) in layout.items():
+        blocks[name] = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=blocks[name].buf)
+
+    return blocks, arrays
+
+def strip_worker(layout, n, first, last, row, pipe, half_sweep):
+    blocks, arrays = attach(layout)
+    grid = arrays["grid"]
+    table = arrays["table"]
+    energies = arrays["energies"]
+    rng_states = arrays["rng_states"]
+    partials = arrays["partials"][row]
+    strip_monte_carlo_step(grid, n, 0, 0, 0, table, energies, rng_states, partials)
+
+    while True:
+        # sweeps to run from the parent, negative to stop, EOFError if the
+        # parent is gone
+        try:
+            sweeps = pipe.recv()
+        except EOFError:
+            break
+        if sweeps < 0:
+            break
+        for _ in range(sweeps):
+            for color in range(2):
+                strip_monte_carlo_step(
+                    grid, n, first, last, color, table, energies, rng_states, partials
+                )
+                # the other sublattice reads the rows next to the strip
+                half_sweep.wait()
+        pipe.send(None)
+
+class SharedLattice:
+    # rows of the lattice split into strips owned by worker processes, the
+    # lattice, tables and RNG streams live in shared memory and nothing is
+    # copied between processes, workers meet at a barrier after every
+    # half-sweep, so neighbouring strips see each other's boundary rows
+    def __init__(self, n, processes):
+        processes = min(processes, n)
+        specs = {
+            "grid": ((n, n), np.int8),
+            "table": ((10,), np.float64),
+            "energies": ((10,), np.float64),
+            "rng_states": ((n,), np.uint64),
+            "partials": ((processes, 2), np.float64),
+        }
+        self.blocks = {}
+        layout = {}
+        for name, (shape, dtype) in specs.items():
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            self.blocks[name] = shared_memory.SharedMemory(create=True, size=size)
+            layout[name] = (self.blocks[name].name, shape, dtype)
+        self.arrays = {
+            name: np.ndarray(shape, dtype=dtype, buffer=self.blocks[name].buf)
+            for name, (_, shape, dtype) in layout.items()
+        }
+        self.arrays["partials"][:] = 0
+
+        # spawn, forking a process with numba worker threads is not safe
+        context = multiprocessing.get_context("spawn")
+        half_sweep = context.Barrier(processes)
+        bounds = np.linspace(0, n, processes + 1).astype(int)
+        self.pipes = []
+        self.workers = []
+        for k in range(processes):
+            pipe, worker_pipe = context.Pipe()
+            self.pipes.append(pipe)
+            self.workers.append(
+                context.Process(
+                    target=strip_worker,
+                    args=(
+                        layout,
+                        n,
+                        bounds[k],
+                        bounds[k + 1],
+                        k,
+                        worker_pipe,
+                        half_sweep,
+                    ),
+                    daemon=True,
+                )
+            )
+        for worker in self.workers:
+            worker.start()
+        self.closed = False
+        # returns once every worker compiled its kernel
+        self.sweep(0)
+
+    def load(self, lattice, table, energies, rng_states):
+        self.arrays["grid"][:] = lattice
+        self.arrays["table"][:] = table
+        self.arrays["energies"][:] = energies
+        self.arrays["rng_states"][:] = rng_states
+        return self.arrays["grid"]
+
+    def sweep(self, sweeps=1):
+        # (dM, dE) of the sweeps, the parent waits on the pipes and on the
+        # workers themselves, so a worker that dies, killed or by an
+        # exception, is an error instead of a hang at the barrier
+        try:
+            for pipe in self.pipes:
+                pipe.send(sweeps)
+            pending = list(self.pipes)
+            sentinels = [worker.sentinel for worker in self.workers]
+            while pending:
+                ready = connection.wait(pending + sentinels)
+                if any(sentinel in ready for sentinel in sentinels):
+                    raise EOFError
+                for pipe in ready:
+                    pipe.recv()
+                    pending.remove(pipe)
+        except (EOFError, OSError):
+            self.close()
+            exit_codes = [worker.exitcode for worker in self.workers]
+            raise RuntimeError(
+                f"A shared lattice worker died, exit codes {exit_codes}"
+            ) from None
+        delta = self.arrays["partials"].sum(axis=0)
+        self.arrays["partials"][:] = 0
+        return delta
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for pipe in self.pipes:
+            try:
+                pipe.send(-1)
+            except OSError:
+                pass
+        for worker in self.workers:
+            worker.join(timeout=1)
+        # workers left waiting at the barrier for a dead one
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        # views of the lattice may outlive the backend, the mappings go away
+        # with the process
+        for block in self.blocks.values():
+            block.unlink()
+
+# one backend per grid size and process count, reused when prepare is called
+# again, e.g. after every checkpoint
+shared_lattices = {}
+
+def shared_lattice(n, processes):
+    backend = shared_lattices.get((n, processes))
+    if backend is None or backend.closed:
+        shared_lattices[n, processes] = SharedLattice(n, processes)
+
+    return shared_lattices[n, processes]
+
+@atexit.register
+def close_shared_lattices():
+    while shared_lattices:
+        shared_lattices.popitem()[1].close()
+
+def prepare(args, lattice=None, calibration=None):
+    # kernels, buffers and a fresh random lattice (unless one is given) of a mode,
+    # calibrated kernel parameters are stored in (or taken from) calibration
+    n = args.number
+    J = args.j_value
+    beta = args.beta
+    B = args.B_value
+    spin_density = args.density
+
+    if args.threads:
+        numba.set_num_threads(args.threads)
+    if args.seed is not None:
+        np.random.seed(args.seed)
+        seed_numba(args.seed)
+
+    table = acceptance_table(J, B, beta)
+    energies = energy_table(J, B)
+
+    def single_lattice(lattice):
+        # a fresh random lattice unless one is given, its totals and a 2x2
+        # lattice to compile the kernel on
+        if lattice is None:
+            lattice = np.random.choice(
+                [-1, 1], size=(n, n), p=[1 - spin_density, spin_density]
+            )
+        warm_up = np.ones((2, 2), dtype=lattice.dtype)
+        return lattice, lattice_totals(lattice, n, J, B), warm_up
+
+    # spins of the lattice to render, a single lattice is its own
+    spins = np.asarray
+
+    # every mode sets up its lattice, its totals and its sweep
+    if args.mode == "random":
+        lattice, totals, warm_up = single_lattice(lattice)
+        monte_carlo_step(warm_up, 2, J, B, beta, np.zeros(2))
+
+        def sweep(grid):
+            return monte_carlo_step(grid, n, J, B, beta, totals)
+    elif args.mode == "table":
+        lattice, totals, warm_up = single_lattice(lattice)
+        sites = np.empty((n * n, 2), dtype=np.int64)
+        uniforms = np.empty(n * n)
+        table_monte_carlo_step(
+            warm_up, 2, table, energies, sites[:4], uniforms[:4], np.zeros(2)
+        )
+
+        def sweep(grid):
+            return table_monte_carlo_step(
+                grid, n, table, energies, sites, uniforms, totals
+            )
+    elif args.mode == "parallel":
+        if n % 2:
+            raise ValueError("Parallel mode requires an even grid size")
+        lattice, totals, warm_up = single_lattice(lattice)
+        rng_states = make_streams(args.seed, n)
+        parallel_monte_carlo_step(
+            warm_up, 2, table, energies, rng_states[:2].copy(), np.zeros(2)
+        )
+
+        def sweep(grid):
+            return parallel_monte_carlo_step(
+                grid, n, table, energies, rng_states, totals
+            )
+    elif args.mode == "packed":
+        if n % 64:
+            raise ValueError("Packed mode requires a grid size divisible by 64")
+        rng_states = make_streams(args.seed, n)
+        thresholds = packed_thresholds(table)
+        class_energies = packed_classes(energies)
+        warm_up = pack_random(64, spin_density, rng_states[:64].copy())
+        packed_monte_carlo_step(
+            warm_up, 64, thresholds, class_energies, rng_states[:64].copy(), np.zeros(2)
+        )
+        packed_totals(warm_up, 64, J, B)
+        unpack(warm_up, 64)
+
+        if lattice is None:
+            lattice = pack_random(n, spin_density, rng_states)
+        totals = packed_totals(lattice, n, J, B)
+
+        def sweep(words):
+            return packed_monte_carlo_step(
+                words, n, thresholds, class_energies, rng_states, totals
+            )
+        spins = partial(unpack, n=n)
+    elif args.mode == "wolff":
+        if J <= 0:
+            raise ValueError("Cluster updates require a ferromagnetic J > 0")
+        p_add = 1 - np.exp(-2 * beta * J)
+        lattice, totals, _ = single_lattice(lattice)
+        stack = np.empty(n * n, dtype=np.int64)
+        cluster = np.empty(n * n, dtype=np.int64)
+        in_cluster = np.zeros((n, n), dtype=np.bool_)
+        # calibration sweeps also thermalize the lattice and compile the kernel
+        calibration = {} if calibration is None else calibration
+        if "clusters" not in calibration:
+            for _ in range(WOLFF_CALIBRATION_SWEEPS):
+                clusters = wolff_calibrate(
+                    lattice, n, J, B, p_add, beta, stack, cluster, in_cluster, totals
+                )
+            calibration["clusters"] = int(clusters)
+        clusters = calibration["clusters"]
+        wolff_step(
+            lattice, n, J, B, p_add, beta, 0, stack, cluster, in_cluster, totals
+        )
+
+        def sweep(grid):
+            return wolff_step(
+                grid, n, J, B, p_add, beta, clusters, stack, cluster, in_cluster, totals
+            )
+    elif args.mode == "swendsen-wang":
+        if J <= 0:
+            raise ValueError("Cluster updates require a ferromagnetic J > 0")
+        p_add = 1 - np.exp(-2 * beta * J)
+        lattice, totals, warm_up = single_lattice(lattice)
+        parent = np.empty(n * n, dtype=np.int64)
+        sizes = np.empty(n * n, dtype=np.int64)
+        swendsen_wang_step(
+            warm_up, 2, J, B, p_add, beta, parent[:4], sizes[:4], np.zeros(2)
+        )
+
+        def sweep(grid):
+            return swendsen_wang_step(
+                grid, n, J, B, p_add, beta, parent, sizes, totals
+            )
+    elif args.mode == "ensemble":
+        rng_states = make_streams(args.seed, args.replicas)
+        if lattice is None:
+            lattice = np.random.choice(
+                [-1, 1],
+                size=(args.replicas, n, n),
+                p=[1 - spin_density, spin_density],
+            )
+        totals = ensemble_totals(lattice, n, J, B)
+        ensemble_monte_carlo_step(
+            np.ones((1, 2, 2), dtype=lattice.dtype),
+            2, table, energies, rng_states[:1].copy(), np.zeros((1, 2)),
+        )
+
+        def sweep(grids):
+            return ensemble_monte_carlo_step(
+                grids, n, table, energies, rng_states, totals
+            )
+        # the first replica is rendered
+        spins = itemgetter(0)
+    elif args.mode == "shared":
+        if n % 2:
+            raise ValueError("Shared mode requires an even grid size")
+        lattice, totals, _ = single_lattice(lattice)
+        backend = shared_lattice(n, args.processes or os.cpu_count())
+        lattice = backend.load(lattice, table, energies, make_streams(args.seed, n))
+
+        def sweep(grid):
+            totals[:] += backend.sweep()
+            return grid
+
+    def measure(lattice):
+        # magnetization and energy per site, (replicas,) arrays in ensemble mode
+        return totals[..., 0] / (n * n), totals[..., 1] / (n * n)
+
+    return lattice, sweep, measure, spins
+
+class Checkpoint:
+    # lattice snapshots in a memory-mapped .npy file with two slots written in
+    # turn (a crash while writing one leaves the other intact), step counter and
+    # seed in state.json and one append-only float64 log per observable
+    columns = ("magnetization", "energy")
+
+    def __init__(self, directory, args):
+        self.directory = f"project04/out/{directory}"
+        os.makedirs(self.directory, exist_ok=True)
+        self.state_path = os.path.join(self.directory, "state.json")
+        self.lattice_path = os.path.join(self.directory, "lattice.npy")
+        # everything the logged samples depend on, a resume must match it
+        self.config = {
+            "mode": args.mode,
+            "number": args.number,
+            "shape": [args.replicas] if args.mode == "ensemble" else [],
+            "j_value": args.j_value,
+            "beta": args.beta,
+            "B_value": args.B_value,
+            "thermalization": args.thermalization,
+        }
+
+        self.step = 0
+        self.seed = args.seed
+        if self.seed is None:
+            self.seed = int(np.random.SeedSequence().generate_state(1)[0])
+        self.slot = 0
+        self.calibration = {}
+        self.snapshots = None
+        self.lattice = None
+        if args.resume and os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if state["config"] != self.config:
+                raise ValueError(
+                    f"Checkpoint in {self.directory} was saved with {state['config']}"
+                )
+            self.step = state["step"]
+            self.seed = state["seed"]
+            self.slot = state["slot"]
+            self.calibration = state["calibration"]
+            self.snapshots = np.lib.format.open_memmap(self.lattice_path, mode="r+")
+            self.lattice = np.array(self.snapshots[self.slot])
+        else:
+            # a fresh run replaces the old checkpoint, a resume after it is
+            # killed before its first save must not continue the old lattice
+            for path in (self.state_path, self.lattice_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        # drop whatever was logged after the checkpoint
+        row_bytes = 8 * int(np.prod(self.config["shape"]))
+        self.logs = {}
+        for name in self.columns:
+            path = os.path.join(self.directory, f"{name}.f64")
+            log = open(path, "r+b" if self.step else "wb")
+            log.truncate(self.step * row_bytes)
+            log.seek(0, os.SEEK_END)
+            self.logs[name] = log
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for log in self.logs.values():
+            log.close()
+
+    def segment_args(self, args):
+        # random streams restart from (seed, step) at every checkpoint, so a
+        # resumed run continues exactly like an uninterrupted one
+        seed = self.seed
+        if self.step:
+            seed = int(
+                np.random.SeedSequence([self.seed, self.step]).generate_state(1)[0]
+            )
+        return argparse.Namespace(**{**vars(args), "seed": seed})
+
+    def append(self, magnetization, energy):
+        for name, value in zip(self.columns, (magnetization, energy)):
+            self.logs[name].write(np.asarray(value, dtype=np.float64).tobytes())
+
+    def save(self, step, lattice):
+        if self.snapshots is None:
+            self.snapshots = np.lib.format.open_memmap(
+                self.lattice_path,
+                mode="w+",
+                dtype=lattice.dtype,
+                shape=(2,) + lattice.shape,
+            )
+        self.slot = 1 - self.slot
+        self.snapshots[self.slot] = lattice
+        self.snapshots.flush()
+        for log in self.logs.values():
+            log.flush()
+            os.fsync(log.fileno())
+
+        self.step = step
+        state = {
+            "config": self.config,
+            "step": self.step,
+            "seed": self.seed,
+            "slot": self.slot,
+            "calibration": self.calibration,
+        }
+        with open(f"{self.state_path}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{self.state_path}.tmp", self.state_path)
+
+def read_log(directory):
+    # observable logs of a checkpoint directory as (steps,) or (steps, replicas)
+    # memory maps, may run past the last checkpoint if the run was interrupted
+    directory = f"project04/out/{directory}"
+    with open(os.path.join(directory, "state.json")) as f:
+        shape = json.load(f)["config"]["shape"]
+
+    return {
+        name: np.memmap(
+            os.path.join(directory, f"{name}.f64"), dtype=np.float64, mode="r"
+        ).reshape(-1, *shape)
+        for name in Checkpoint.columns
+    }
+
+def track(sequence, total, completed=0, quiet=False):
+    # rich is only imported when the progress bar is shown
+    if quiet:
+        yield from sequence
+        return
+
+    from rich.progress import (
+        BarColumn,
+        MofNCompleteColumn,
+        Progress,
+        TextColumn,
+        TimeElapsedColumn,
+        TimeRemainingColumn,
+    )
+
     progress_bar = Progress(
         TextColumn("Simulating:"),
         TextColumn("[bold green]{task.percentage:>3.0f}% "),
@@ -141,48 +1313,122 @@ def simulate(self):
         TextColumn("[bold black]/"),
         TimeRemainingColumn(),
     )
+    with progress_bar as p:
+        yield from p.track(sequence, total=total, completed=completed)
+
+def simulate(args):
     n = args.number
-    J = args.j_value
-    beta = args.beta
-    B = args.B_value
     steps = args.steps
-    spin_density = args.density
     image_prefix = args.image_prefix
     animation_file = args.animation_file
     magnetization_file = args.magnetization_file
 
-    grid = np.random.choice(
-        [-1, 1], size=(n, n), p=[1 - spin_density, spin_density]
-    )
+    observables = Observables(n, args.beta)
+    if args.checkpoint_dir:
+        checkpoint = Checkpoint(args.checkpoint_dir, args)
+        first = checkpoint.step
+        if first >= steps:
+            raise ValueError(f"Checkpoint is already at step {first}")
+        lattice, sweep, measure, spins = prepare(
+            checkpoint.segment_args(args), checkpoint.lattice, checkpoint.calibration
+        )
+        if first:
+            logs = read_log(args.checkpoint_dir)
+            observables.extend(
+                logs["magnetization"][args.thermalization : first],
+                logs["energy"][args.thermalization : first],
+            )
+    else:
+        checkpoint = nullcontext()
+        first = 0
+        lattice, sweep, measure, spins = prepare(args)
 
     magnetizations = []
 
-    images = []
-    with progress_bar as p:
-        for step in p.track(range(steps)):
-            grid = monte_carlo_step(grid, n, J, B, beta)
-            magnetization = np.sum(grid) / (n * n)
-            magnetizations.append(magnetization)
-
-            if animation_file or image_prefix:
-                images = save_img(grid, n, step, image_prefix)
-
-    if animation_file:
-        images[0].save(
-            f"project04/out/{animation_file}",
-            save_all=True,
-            append_images=images[1:],
-            duration=100,
-            loop=0,
-        )
+    render = animation_file or image_prefix
+    frame_writer = (
+        FrameWriter(image_prefix, animation_file) if render else nullcontext()
+    )
+
+    elapsed = 0.0
+    with checkpoint, frame_writer:
+        for step in track(range(first, steps), steps, first, args.quiet):
+            start = time.perf_counter()
+            lattice = sweep(lattice)
+            elapsed += time.perf_counter() - start
+            magnetization, energy = measure(lattice)
+            if args.checkpoint_dir:
+                checkpoint.append(magnetization, energy)
+                if (step + 1) % args.checkpoint_every == 0 or step + 1 == steps:
+                    checkpoint.save(step + 1, lattice)
+                    lattice, sweep, measure, spins = prepare(
+                        checkpoint.segment_args(args), lattice, checkpoint.calibration
+                    )
+            else:
+                magnetizations.append(magnetization)
+            if step >= args.thermalization:
+                observables.push(magnetization, energy)
+
+            if render and step % args.frame_stride == 0:
+                frame_writer.put(step, spins(lattice))
+
+    # (steps,) for a single lattice, (replicas, steps) in ensemble mode
+    if args.checkpoint_dir:
+        magnetizations = read_log(args.checkpoint_dir)["magnetization"][:steps]
+    magnetizations = np.array(magnetizations).T
 
     if magnetization_file:
         with open(f"project04/out/{magnetization_file}", "w") as f:
-            for step, m in enumerate(magnetizations):
-                f.write(f"{step}\t{m}\n")
+            for step, m in enumerate(magnetizations.T):
+                values = "\t".join(f"{value}" for value in np.atleast_1d(m))
+                f.write(f"{step}\t{values}\n")
+
+    if args.quiet:
+        return magnetizations
+
+    import rich
+    from rich.table import Table
+
+    replicas = len(np.atleast_2d(magnetizations))
+    tau = np.mean(
+        [
+            integrated_autocorrelation_time(np.abs(series))
+            for series in np.atleast_2d(magnetizations)
+        ]
+    )
+    rich.print(
+        f"{replicas * n * n * (steps - first) / elapsed:,.0f} spin-flips/s "
+        f"({args.mode}, {numba.get_num_threads()} threads)"
+    )
+    rich.print(
+        f"tau_int(|m|) = {tau:.2f} sweeps, "
+        f"{replicas * (steps - first) / (2 * tau) / elapsed:,.1f} effective samples/s"
+    )
+
+    if observables.filled > 1:
+        table = Table(title="Observables per site")
+        table.add_column("Observable")
+        table.add_column("Value", justify="right")
+        table.add_column("Error", justify="right")
+        for name, (value, error) in observables.summary().items():
+            table.add_row(
+                name, f"{value:.6g}", "-" if np.isnan(error) else f"{error:.2g}"
+            )
+        rich.print(table)
+
+    return magnetizations
 
 
-args = get_arguments()
-simulate(args)
+if __name__ == "__main__":
+    args = get_arguments()
+    if args.quiet:
+        simulate(args)
+    else:
+        import rich
+        import rich.traceback
 
-rich.get_console().rule("Completed!", style="bold cyan")
+        rich.traceback.install()
+        rich.get_console().clear()
+        rich.get_console().rule("Ising simulation", style="bold cyan")
+        simulate(args)
+        rich.get_console().rule("Completed!", style="bold cyan")
@@ -0,0 +1,276 @@
+# poetry run python project04/tempering.py -n 32 -br 0.3 0.6 16 -s 2000 -th 200 -x 10 -rf scan.txt
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import rich
+from rich.progress import (
+    BarColumn,
+    MofNCompleteColumn,
+    Progress,
+    TextColumn,
+    TimeElapsedColumn,
+    TimeRemainingColumn,
+)
+from rich.table import Table
+import rich.traceback
+
+from numba_ising import Observables, prepare
+
+rich.traceback.install()
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Temperature scan and parallel tempering of the Ising model"
+    )
+    parser.add_argument(
+        "--number", "-n", type=int, default=32, help="Size of grid (default 32)."
+    )
+    parser.add_argument(
+        "--j_value", "-J", type=float, default=1, help="Value of J (default 1)"
+    )
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument(
+        "--betas", "-b", nargs="+", type=float, help="Values of parameter Beta."
+    )
+    group.add_argument(
+        "--beta_range",
+        "-br",
+        nargs=3,
+        type=float,
+        metavar=("START", "STOP", "COUNT"),
+        help="Evenly spaced values of parameter Beta.",
+    )
+    parser.add_argument(
+        "--B_values",
+        "-B",
+        nargs="+",
+        type=float,
+        default=[0.0],
+        help="Values of field B (default 0).",
+    )
+    parser.add_argument(
+        "--steps",
+        "-s",
+        type=int,
+        default=1000,
+        help="Number of measured macrosteps (default 1000).",
+    )
+    parser.add_argument(
+        "--thermalization",
+        "-th",
+        type=int,
+        default=100,
+        help="Number of macrosteps discarded before measuring (default 100).",
+    )
+    parser.add_argument(
+        "--density",
+        "-d",
+        type=float,
+        default=0.5,
+        help="Initial spin density (default 0.5).",
+    )
+    parser.add_argument(
+        "--mode",
+        "-m",
+        type=str,
+        # the kernels of a single lattice in the calling process
+        choices=["random", "table", "parallel", "packed", "wolff", "swendsen-wang"],
+        default="table",
+        help="Sweep kernel of numba_ising (default table).",
+    )
+    parser.add_argument(
+        "--exchange_every",
+        "-x",
+        type=int,
+        help="Macrosteps between replica exchanges (if not provided no exchanges).",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        help="Number of worker processes (default all cores).",
+    )
+    parser.add_argument("--seed", type=int, help="Random seed.")
+    parser.add_argument(
+        "--results_file",
+        "-rf",
+        type=str,
+        help="Results filename (if not provided results only printed)",
+    )
+    args = parser.parse_args()
+
+    if args.beta_range:
+        start, stop, count = args.beta_range
+        args.betas = list(np.linspace(start, stop, int(count)))
+
+    return args
+
+
+def replica_args(args, beta, B, seed):
+    return argparse.Namespace(
+        number=args.number,
+        j_value=args.j_value,
+        beta=beta,
+        B_value=B,
+        density=args.density,
+        mode=args.mode,
+        threads=1,
+        seed=seed,
+    )
+
+
+def warm_up(args):
+    # compile the kernels once per worker instead of once per point
+    warm_up_args = replica_args(args, 0.5, 0.0, 0)
+    warm_up_args.number = 64
+    lattice, sweep, measure, _ = prepare(warm_up_args)
+    measure(sweep(lattice))
+
+
+def run_replica(args, lattice, calibration, beta, B, sweeps, seed):
+    # the calibration of a point is filled in by its first round and passed
+    # back in on the next ones, so Wolff mode calibrates once per point
+    calibration = {} if calibration is None else calibration
+    lattice, sweep, measure, _ = prepare(
+        replica_args(args, beta, B, seed), lattice, calibration
+    )
+
+    magnetizations = np.empty(sweeps)
+    energies = np.empty(sweeps)
+    for step in range(sweeps):
+        lattice = sweep(lattice)
+        magnetizations[step], energies[step] = measure(lattice)
+
+    return lattice, calibration, magnetizations, energies
+
+
+def exchange(points, lattices, energies, offset, rng):
+    # swap configurations of neighbouring betas at the same field, pair k
+    # of points k and k + 1 is counted at k
+    accepted = np.zeros(len(points))
+    attempted = np.zeros(len(points))
+    for k in range(offset, len(points) - 1, 2):
+        (beta_a, B_a), (beta_b, B_b) = points[k], points[k + 1]
+        if B_a != B_b:
+            continue
+        attempted[k] = 1
+        delta = (beta_b - beta_a) * (energies[k + 1] - energies[k])
+        if delta >= 0 or rng.random() < np.exp(delta):
+            lattices[k], lattices[k + 1] = lattices[k + 1], lattices[k]
+            energies[k], energies[k + 1] = energies[k + 1], energies[k]
+            accepted[k] = 1
+
+    return accepted, attempted
+
+
+def scan(args):
+    progress_bar = Progress(
+        TextColumn("Simulating:"),
+        TextColumn("[bold green]{task.percentage:>3.0f}% "),
+        BarColumn(
+            bar_width=120,
+            style="black",
+            complete_style="bold blue",
+            finished_style="bold green",
+        ),
+        MofNCompleteColumn(),
+        TimeElapsedColumn(),
+        TextColumn("[bold black]/"),
+        TimeRemainingColumn(),
+    )
+    points = [(beta, B) for B in args.B_values for beta in sorted(args.betas)]
+    total_steps = args.thermalization + args.steps
+    sweeps = args.exchange_every or total_steps
+    rounds = -(-total_steps // sweeps)
+
+    seeds = np.random.SeedSequence(args.seed).generate_state(
+        len(points) * rounds, dtype=np.uint32
+    ).reshape(len(points), rounds)
+    rng = np.random.default_rng(args.seed)
+
+    N = args.number * args.number
+    lattices = [None] * len(points)
+    calibrations = [None] * len(points)
+    observables = [Observables(args.number, beta) for beta, _ in points]
+    swaps = np.zeros(len(points))
+    attempts = np.zeros(len(points))
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=warm_up, initargs=(args,)
+    ) as executor, progress_bar as p:
+        for r in p.track(range(rounds)):
+            futures = [
+                executor.submit(
+                    run_replica,
+                    args,
+                    lattices[k],
+                    calibrations[k],
+                    beta,
+                    B,
+                    sweeps,
+                    int(seeds[k, r]),
+                )
+                for k, (beta, B) in enumerate(points)
+            ]
+            last_energies = []
+            for k, future in enumerate(futures):
+                lattices[k], calibrations[k], m, e = future.result()
+                # drop the thermalization steps and the overshoot of the last round
+                measured = slice(
+                    max(0, args.thermalization - r * sweeps),
+                    total_steps - r * sweeps,
+                )
+                observables[k].extend(m[measured], e[measured])
+                last_energies.append(e[-1] * N)
+
+            # nothing is measured after the last round, so no exchange either
+            if args.exchange_every and r < rounds - 1:
+                accepted, attempted = exchange(
+                    points, lattices, last_energies, r % 2, rng
+                )
+                swaps += accepted
+                attempts += attempted
+
+    results = []
+    for k, (beta, B) in enumerate(points):
+        summary = observables[k].summary()
+        results.append(
+            (beta, B)
+            + tuple(
+                value
+                for name in ("m", "|m|", "e", "chi", "C")
+                for value in summary[name]
+            )
+            + (swaps[k] / max(1, attempts[k]),)
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    rich.get_console().rule("Ising temperature scan", style="bold cyan")
+    args = get_arguments()
+    results = scan(args)
+
+    names = ("m", "|m|", "E/N", "chi", "C")
+    table = Table()
+    for column in ("beta", "B") + names + ("swap rate",):
+        table.add_column(column, justify="right")
+    for row in results:
+        values = [f"{value:.4f}" for value in row[:2]]
+        values += [f"{v:.4f} ± {e:.4f}" for v, e in zip(row[2:-1:2], row[3:-1:2])]
+        table.add_row(*values, f"{row[-1]:.4f}")
+    rich.print(table)
+
+    columns = ["beta", "B"]
+    for name in names:
+        columns += [name, f"{name} error"]
+    columns.append("swap rate")
+    if args.results_file:
+        with open(f"project04/out/{args.results_file}", "w") as f:
+            f.write("\t".join(columns) + "\n")
+            for row in results:
+                f.write("\t".join(f"{value}" for value in row) + "\n")
+
+    rich.get_console().rule("Completed!", style="bold cyan")
@@ -0,0 +1,50 @@
+# python project10/check_crawler.py
+# crawls the saved pages through serve_pages.py with injected failures
+
+import argparse
+import asyncio
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+from multiproc import Crawler
+from serve_pages import make_handler
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+
+
+if __name__ == '__main__':
+    server_args = argparse.Namespace(pages_dir=PAGES_DIR, delay=0.05, fail_rate=0.3)
+    handler = make_handler(server_args)
+    handler.log_message = lambda *args: None
+    server = ThreadingHTTPServer(('localhost', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://localhost:{server.server_port}'
+
+    urls = [
+        f'{base_url}/list/show/1?ref=ls_pl_car_0',
+        f'{base_url}/list/show/264?ref=ls_pl_car_1',
+        # missing page, unreachable host and malformed url, each yields no books
+        f'{base_url}/list/show/999',
+        'http://localhost:1/list/show/6',
+        'localhost/list/show/43',
+    ]
+    crawler = Crawler(per_host=2, timeout=5, retries=8, backoff=0.01)
+    books = asyncio.run(crawler.crawl(urls))
+    server.shutdown()
+
+    assert len(books) == 6, books
+    assert books[0] == {
+        "Rank": 1,
+        "Title": "The Hunger Games (The Hunger Games, #1)",
+        "Author": "Suzanne Collins",
+        "Rating": 4.34,
+        "Number of Ratings": 9381090,
+        "list": "Best Books Ever",
+    }, books[0]
+    assert [book["Rank"] for book in books] == [1, 2, 3, 1, 2, 3]
+    assert {book["list"] for book in books} == {
+        "Best Books Ever",
+        "Books That Everyone Should Read At Least Once",
+    }
+    print(f'OK, {len(books)} books from {len(urls)} urls')
@@ -1,62 +1,167 @@
-import requests
-from bs4 import BeautifulSoup
+# python project10/multiproc.py
+# python project10/multiproc.py --save_pages project10/pages
+# python project10/serve_pages.py project10/pages & python project10/multiproc.py --base_url http://localhost:8000
+# python project10/check_crawler.py
+
+import argparse
+import asyncio
 import json
+import os
+import random
 import re
-from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
 
 headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36',
     'Accept-Language': 'en-US,en;q=0.9'
 }
 
-def scrape_url(url):
-    try:
-        res = requests.get(url, headers=headers)
-        if res.status_code != 200:
-            print(f"Failed to retrieve {url}, status code: {res.status_code}")
-            return []
+urls = ['https://www.goodreads.com/list/show/1?ref=ls_pl_car_0', 'https://www.goodreads.com/list/show/264?ref=ls_pl_car_1', 'https://www.goodreads.com/list/show/43?ref=ls_pl_car_2', 'https://www.goodreads.com/list/show/1043?ref=ls_pl_car_3', 'https://www.goodreads.com/list/show/6?ref=ls_pl_car_4']
 
-        soup = BeautifulSoup(res.text, 'html.parser')
+# responses worth another attempt, rate limiting and server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# longest Retry-After honoured, in seconds
+MAX_RETRY_AFTER = 60
 
-        books = soup.find_all('tr', {'itemtype': 'http://schema.org/Book'})
-        listname = soup.find('h1', class_='gr-h1 gr-h1--serif').get_text(strip=True)
-        book_list = []
 
-        for book in books:
-            rank = int(book.find('td', class_='number').get_text(strip=True))
-            title = book.find('a', class_='bookTitle').get_text(strip=True)
-            author = book.find('a', class_='authorName').get_text(strip=True)
+def parse_books(html):
+    soup = BeautifulSoup(html, 'html.parser')
 
-            rating_text = book.find('span', class_='minirating').get_text(strip=True)
-            rating = float(re.search(r'\d+\.\d+', rating_text).group())
+    books = soup.find_all('tr', {'itemtype': 'http://schema.org/Book'})
+    listname = soup.find('h1', class_='gr-h1 gr-h1--serif').get_text(strip=True)
+    book_list = []
 
-            num_ratings_text = book.find('span', class_='minirating').get_text(strip=True).split(' — ')[-1]
-            num_ratings = int(num_ratings_text.split(' ')[0].replace(',', ''))
+    for book in books:
+        rank = int(book.find('td', class_='number').get_text(strip=True))
+        title = book.find('a', class_='bookTitle').get_text(strip=True)
+        author = book.find('a', class_='authorName').get_text(strip=True)
 
-            book_list.append({
-                "Rank": rank,
-                "Title": title,
-                "Author": author,
-                "Rating": rating,
-                "Number of Ratings": num_ratings,
-                "list": listname,
-            })
+        rating_text = book.find('span', class_='minirating').get_text(strip=True)
+        rating = float(re.search(r'\d+\.\d+', rating_text).group())
 
-        return book_list
+        num_ratings_text = book.find('span', class_='minirating').get_text(strip=True).split(' — ')[-1]
+        num_ratings = int(num_ratings_text.split(' ')[0].replace(',', ''))
 
-    except Exception as e:
-        print(f"Error while scraping {url}: {e}")
-        return []
+        book_list.append({
+            "Rank": rank,
+            "Title": title,
+            "Author": author,
+            "Rating": rating,
+            "Number of Ratings": num_ratings,
+            "list": listname,
+        })
 
+    return book_list
+
+
+def page_name(url):
+    # file of a page in a directory of saved pages, the query is ignored
+    path = urlsplit(url).path.strip('/') or 'index'
+    return re.sub(r'[^\w.-]', '_', path) + '.html'
+
+
+def make_session(pool_size):
+    # one keep-alive connection pool per host, shared by all requests
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class Crawler:
+    # requests run in threads through one pooled session, the event loop caps
+    # the requests in flight per host and retries with jittered backoff
+    def __init__(self, per_host=4, timeout=30, retries=3, backoff=1.0, pages_dir=None):
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pages_dir = pages_dir
+        self.session = make_session(per_host)
+        self.semaphores = {}
+
+    def delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+        if retry_after.isdigit():
+            return min(float(retry_after), MAX_RETRY_AFTER)
+        # full jitter, spreads out the retries of concurrent requests
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    async def fetch(self, url):
+        host = urlsplit(url).netloc
+        semaphore = self.semaphores.setdefault(host, asyncio.Semaphore(self.per_host))
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                async with semaphore:
+                    response = await asyncio.to_thread(self.session.get, url, timeout=self.timeout)
+                if response.status_code == 200:
+                    return response.text
+                if response.status_code not in RETRY_STATUSES:
+                    print(f"Failed to retrieve {url}, status code: {response.status_code}")
+                    return None
+                error = f"status code: {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                # transient failures, anything else is raised to scrape
+                error = e
+            if attempt < self.retries:
+                await asyncio.sleep(self.delay(attempt, response))
+
+        print(f"Failed to retrieve {url} after {self.retries + 1} attempts, {error}")
+        return None
+
+    async def scrape(self, url):
+        # a failing url yields no books and does not stop the crawl
+        try:
+            html = await self.fetch(url)
+            if html is None:
+                return []
+            if self.pages_dir:
+                with open(os.path.join(self.pages_dir, page_name(url)), 'w', encoding='utf-8') as f:
+                    f.write(html)
+            # parsing is CPU bound, a thread keeps the event loop free
+            return await asyncio.to_thread(parse_books, html)
+        except Exception as e:
+            print(f"Error while scraping {url}: {e}")
+            return []
+
+    async def crawl(self, urls):
+        if self.pages_dir:
+            os.makedirs(self.pages_dir, exist_ok=True)
+        with self.session:
+            results = await asyncio.gather(*(self.scrape(url) for url in urls))
+        return [book for books in results for book in books]
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Scraper of Goodreads lists')
+    parser.add_argument('--urls', '-u', nargs='+', default=urls, help='List pages to scrape (default five Goodreads lists).')
+    parser.add_argument('--base_url', '-bu', type=str, help='Scheme and host replacing those of the urls, e.g. a local stand-in server.')
+    parser.add_argument('--per_host', '-ph', type=int, default=4, help='Maximal number of requests in flight per host (default 4).')
+    parser.add_argument('--timeout', '-t', type=float, default=30, help='Timeout of a request in seconds (default 30).')
+    parser.add_argument('--retries', '-r', type=int, default=3, help='Number of retries of a failed request (default 3).')
+    parser.add_argument('--backoff', '-bo', type=float, default=1.0, help='Base delay of the retries in seconds, doubled per retry (default 1).')
+    parser.add_argument('--save_pages', '-sp', type=str, help='Directory to save the fetched pages to, for the stand-in server.')
+    parser.add_argument('--output', '-o', type=str, default=os.path.join('project10', 'books.json'), help='Output filename (default project10/books.json).')
+    args = parser.parse_args()
+
+    if args.base_url:
+        base = urlsplit(args.base_url)
+        args.urls = [urlunsplit(urlsplit(url)._replace(scheme=base.scheme, netloc=base.netloc)) for url in args.urls]
+
+    return args
 
-urls = ['https://www.goodreads.com/list/show/1?ref=ls_pl_car_0', 'https://www.goodreads.com/list/show/264?ref=ls_pl_car_1', 'https://www.goodreads.com/list/show/43?ref=ls_pl_car_2', 'https://www.goodreads.com/list/show/1043?ref=ls_pl_car_3', 'https://www.goodreads.com/list/show/6?ref=ls_pl_car_4']
 
-all_books = []
-with ThreadPoolExecutor() as executor:
-    results = executor.map(scrape_url, urls)
-    for result in results:
-        all_books.extend(result)
+if __name__ == '__main__':
+    args = get_arguments()
+    crawler = Crawler(args.per_host, args.timeout, args.retries, args.backoff, args.save_pages)
+    all_books = asyncio.run(crawler.crawl(args.urls))
 
-# Save to a file
-with open(r'.\project10\books.json', 'w') as file:
-    json.dump(all_books, file, indent=4)
+    # Save to a file
+    with open(args.output, 'w') as file:
+        json.dump(all_books, file, indent=4)
@@ -0,0 +1,56 @@
+# python project10/serve_pages.py project10/pages --fail_rate 0.3 --delay 0.2
+# local stand-in of Goodreads serving pages saved by multiproc.py --save_pages
+
+import argparse
+import os
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from multiproc import page_name
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Local stand-in of the scraped site')
+    parser.add_argument('pages_dir', type=str, help='Directory of the saved pages.')
+    parser.add_argument('--port', '-p', type=int, default=8000, help='Port to listen on (default 8000).')
+    parser.add_argument('--delay', '-d', type=float, default=0, help='Seconds before every response (default 0).')
+    parser.add_argument('--fail_rate', '-f', type=float, default=0, help='Fraction of requests answered with 503 (default 0).')
+    return parser.parse_args()
+
+
+def make_handler(args):
+    class PageHandler(BaseHTTPRequestHandler):
+        # HTTP/1.1 keeps the connections alive, as the real site does
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(args.delay)
+            if random.random() < args.fail_rate:
+                self.reply(503, b'Service Unavailable', {'Retry-After': '0'})
+                return
+            try:
+                with open(os.path.join(args.pages_dir, page_name(self.path)), 'rb') as f:
+                    self.reply(200, f.read(), {'Content-Type': 'text/html; charset=utf-8'})
+            except FileNotFoundError:
+                self.reply(404, b'Not Found')
+
+        def reply(self, status, body, headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return PageHandler
+
+
+if __name__ == '__main__':
+    args = get_arguments()
+    server = ThreadingHTTPServer(('localhost', args.port), make_handler(args))
+    print(f'Serving {args.pages_dir} on http://localhost:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()